@@ -1,6 +1,5 @@
 from environment import Environment
 from entities import Tree, MossyRock, SnowyRock, Outpost, WoodPath
-from terrains import DeepWater, Water
 from knowledge_graph import KnowledgeGraph as KG
 import time
 
@@ -64,30 +63,20 @@ class Agent:
     def move_agent(self, dx, dy):
         new_x, new_y = self.environment.move_entity(self.agent, dx, dy)
         self.kg.move_player_node(new_x, new_y)
-        self.energy_spent += self.environment.terrain_object_grid[new_x, new_y].energy_requirement
+        self.energy_spent += int(self.environment.energy_requirement[new_x, new_y])
 
     def scout(self):
         """ Looking at the environment is a deliberate action. """
         """ Adding a terrain node automatically adds the corresponding entity node"""
 
-        discovered_now = 0
         vision = int(self.vision_range * 2)
-        
-        for y in range(self.agent.grid_y - vision, self.agent.grid_y + vision + 1):
-            for x in range(self.agent.grid_x - vision, self.agent.grid_x + vision + 1):
-                if self.environment.within_bounds(x, y):
-                    boo = self.kg.discover_this_coordinate(x, y)
-                    if boo:
-                        discovered_now += 1
-
-        return discovered_now
+        region = self.kg.get_region_mask((self.agent.grid_x, self.agent.grid_y), vision)
+        return self.kg.discover_region(region)
 
     def build_path(self):
         if (self.agent.grid_x, self.agent.grid_y) in self.environment.outpost_locations:
             return
-        if isinstance(self.environment.terrain_object_grid[self.agent.grid_x, self.agent.grid_y], Water):
-            return
-        if isinstance(self.environment.terrain_object_grid[self.agent.grid_x, self.agent.grid_y], DeepWater):
+        if self.environment.elevation[self.agent.grid_x, self.agent.grid_y] <= 1:  # Deep water or water
             return
         if self.wood >= 1:
             self.wood -= 1
@@ -98,9 +87,10 @@ class Agent:
         if self.stone < 1:
             return
         place = -1
-        if isinstance(self.environment.terrain_object_grid[self.agent.grid_x, self.agent.grid_y], DeepWater):
+        elevation = self.environment.elevation[self.agent.grid_x, self.agent.grid_y]
+        if elevation == 0:  # Deep water
             place = 0
-        elif isinstance(self.environment.terrain_object_grid[self.agent.grid_x, self.agent.grid_y], Water):
+        elif elevation == 1:  # Water
             place = 1
         else:
             return
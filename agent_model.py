@@ -1,10 +1,14 @@
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch_geometric.nn import GATConv, global_mean_pool
 from torch_geometric.data import Data
+from stable_baselines3.common.buffers import DictRolloutBuffer
+from stable_baselines3.common.policies import MultiInputActorCriticPolicy
 from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
 import gymnasium as gym
+from renderer import Vision_Rasterizer
 
 torch_dtype = torch.float32
 
@@ -65,7 +69,7 @@ class VisionProcessor(BaseFeaturesExtractor):
         
         # Build the convolutional layers
         conv_layers = []
-        in_channels = 3
+        in_channels = channels
         for out_channels in self.conv_channels[:self.num_conv_layers]:
             conv_layers.append(nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1))
             conv_layers.append(nn.BatchNorm2d(out_channels))
@@ -112,6 +116,18 @@ class VisionProcessor(BaseFeaturesExtractor):
         return x
 
 
+class SymbolicVisionProcessor(VisionProcessor):
+    """
+    Lightweight VisionProcessor for symbolic vision, a (channels, tiles, tiles) grid of one-hot terrain,
+    entity and player ids at tile resolution (see Vision_Rasterizer.render_symbolic). The grid has one cell
+    per tile instead of tile_size squared pixels, so fewer and narrower convolutions are enough.
+    """
+    default_params = {'num_conv_layers': 2, 'conv_channels': [32, 64], 'fc_dims': [256]}
+
+    def __init__(self, observation_space, vision_params=None, features_dim=96):
+        super().__init__(observation_space, {**self.default_params, **(vision_params or {})}, features_dim)
+
+
 class GraphProcessor(nn.Module):
     """
     GraphProcessor is a neural network module designed for processing graph-structured data.
@@ -179,7 +195,7 @@ class GraphProcessor(nn.Module):
             nn.Linear(self.fc_dims[0], output_dim)
         )
 
-    def forward(self, x, edge_index, batch):
+    def forward(self, x, edge_index, batch, num_graphs=None):
         # print(f"Input x shape: {x.shape}")
         # print(f"Input edge_index shape: {edge_index.shape}")
         # print(f"Input batch shape: {batch.shape}")
@@ -189,7 +205,7 @@ class GraphProcessor(nn.Module):
             x = F.relu(gat_layer(x, edge_index))
             # print(f"After GAT layer {i}: x shape = {x.shape}")
         
-        x = global_mean_pool(x, batch)
+        x = global_mean_pool(x, batch, num_graphs)
         # print(f"After global_mean_pool: x shape = {x.shape}")
         
         x = self.fc(x)
@@ -238,7 +254,7 @@ class AgentModel(BaseFeaturesExtractor):
         Initializes the weights of the convolutional and fully connected layers using Kaiming normalization.
     """
     
-    def __init__(self, observation_space: gym.spaces.Dict, features_dim: int = 192):
+    def __init__(self, observation_space: gym.spaces.Dict, features_dim: int = 192, vision_mode: str = None):
         """
         Initializes the AgentModel object.
 
@@ -250,6 +266,9 @@ class AgentModel(BaseFeaturesExtractor):
             and the 'node_features' key should map to a space with the shape of the graph node features.
         features_dim : int, optional
             The dimensionality of the final output feature vector produced by the model. The default value is 192.
+        vision_mode : str, optional
+            'pixels' or 'symbolic', matching CustomEnv.vision_mode. By default it is taken from the vision channel
+            count, symbolic vision has Vision_Rasterizer.num_symbolic_channels channels and pixels have 3.
         """
         super().__init__(observation_space, features_dim=features_dim)
         
@@ -266,11 +285,29 @@ class AgentModel(BaseFeaturesExtractor):
         # Dropout probability
         self.dropout_p = 0.25
         
+        # Compact observations carry uint8 pixels and features with the masks packed into bits (see CustomEnv)
+        self.compact = 'node_mask' in observation_space.spaces
+        self.register_buffer('mask_bit_shifts', torch.arange(7, -1, -1, dtype=torch.uint8), persistent=False)
+        # Active graph observations hold only active nodes and edges, counted by num_nodes and num_edges
+        self.active_graph = 'num_nodes' in observation_space.spaces
+        self.graph_batch_layouts = {}  # Per batch shape and device, see graph_batch_layout
+        # Symbolic vision is one-hot ids in {0, 1} instead of pixels (see CustomEnv.vision_mode)
+        num_vision_channels = observation_space.spaces['vision'].shape[0]
+        if vision_mode is None:
+            vision_mode = 'symbolic' if num_vision_channels == Vision_Rasterizer.num_symbolic_channels else 'pixels'
+        assert vision_mode in ('pixels', 'symbolic'), f"Unknown vision mode {vision_mode}"
+        self.symbolic_vision = vision_mode == 'symbolic'
+        expected_channels = Vision_Rasterizer.num_symbolic_channels if self.symbolic_vision else 3
+        assert num_vision_channels == expected_channels, f"{vision_mode} vision needs {expected_channels} channels, got {num_vision_channels}"
+
         # Initialize VisionProcessor and GraphProcessor with parameters
         vision_shape = observation_space.spaces['vision'].shape
-        num_node_features = observation_space.spaces['node_features'].shape[1]
+        num_node_features = observation_space.spaces['node_features'].shape[1] + (1 if self.compact else 0)  # Unpacked node mask
         
-        self.vision_processor = VisionProcessor(vision_shape, vision_params=self.vision_params, features_dim=features_dim)
+        if self.symbolic_vision:
+            self.vision_processor = SymbolicVisionProcessor(vision_shape, features_dim=features_dim)
+        else:
+            self.vision_processor = VisionProcessor(vision_shape, vision_params=self.vision_params, features_dim=features_dim)
         self.graph_processor = GraphProcessor(num_node_features, graph_params=self.graph_params, output_dim=features_dim)
         
         # Combine the output sizes from both processors
@@ -308,23 +345,25 @@ class AgentModel(BaseFeaturesExtractor):
         torch.Tensor
             The output feature vector of size (batch_size, features_dim).
         """
+        # Compact observations reach the model in their storage dtypes (CompactMultiInputPolicy) and are upcast here
+        vision = observations['vision']
+        if vision.dtype == torch.uint8:
+            vision = vision.to(torch_dtype) if self.symbolic_vision else vision.to(torch_dtype) / 255.0
+        node_features = observations['node_features'].to(torch_dtype)
+        if self.compact:
+            node_mask = self.unpack_mask(observations['node_mask'], node_features.shape[1])
+            node_features = torch.cat((node_features, node_mask.unsqueeze(-1)), dim=-1)
+
         # Process the visual input through the VisionProcessor
-        vision_features = self.vision_processor(observations['vision'])
-        
-        # Handle batched graph data
-        batch_size = observations['node_features'].shape[0]
-        num_nodes = observations['node_features'].shape[1]
+        vision_features = self.vision_processor(vision)
         
-        # Reshape and process graph features
-        x = observations['node_features'].view(batch_size * num_nodes, -1).to(torch_dtype)
-        edge_index = observations['edge_index'].long()
-        edge_index = edge_index + (torch.arange(batch_size, device=edge_index.device) * num_nodes).view(-1, 1, 1)
-        edge_index = edge_index.view(2, -1)
-        
-        batch = torch.arange(batch_size, device=x.device).repeat_interleave(num_nodes)
+        # Handle batched graph data, keeping only the valid nodes and edges of every observation
+        batch_size = node_features.shape[0]
+        node_valid, edge_valid = self.get_valid_masks(node_features, observations)
+        x, edge_index, batch = self.batch_graphs(node_features, observations['edge_index'], node_valid, edge_valid)
         
         # Process the graph input through the GraphProcessor
-        graph_features = self.graph_processor(x, edge_index, batch)
+        graph_features = self.graph_processor(x, edge_index, batch, batch_size)
         
         # Combine vision and graph features
         combined = torch.cat((vision_features, graph_features), dim=1)
@@ -335,6 +374,61 @@ class AgentModel(BaseFeaturesExtractor):
         
         return features
 
+    def graph_batch_layout(self, batch_size, max_nodes, max_edges, device):
+        """
+        Node offsets, padded batch vector and node and edge positions of a batch of padded graphs.
+        Built once per batch shape, as SB3 only uses a few batch sizes.
+        """
+        key = (batch_size, max_nodes, max_edges, device)
+        if key not in self.graph_batch_layouts:
+            graph_ids = torch.arange(batch_size, device=device)
+            self.graph_batch_layouts[key] = (
+                (graph_ids * max_nodes).view(-1, 1, 1),
+                graph_ids.repeat_interleave(max_nodes),
+                torch.arange(max_nodes, device=device),
+                torch.arange(max_edges, device=device)
+            )
+        return self.graph_batch_layouts[key]
+
+    def get_valid_masks(self, node_features, observations):
+        """
+        Boolean (batch_size, max_nodes) and (batch_size, max_edges) masks of the rows holding real structure:
+        the first num_nodes and num_edges rows of active graph observations, otherwise the rows whose mask is 1,
+        which leaves out the padding as well as the undiscovered nodes.
+        """
+        batch_size, max_nodes = node_features.shape[:2]
+        max_edges = observations['edge_index'].shape[2]
+        if self.active_graph:
+            _, _, node_positions, edge_positions = self.graph_batch_layout(batch_size, max_nodes, max_edges, node_features.device)
+            node_valid = node_positions < observations['num_nodes'].view(-1, 1)
+            edge_valid = edge_positions < observations['num_edges'].view(-1, 1)
+        else:
+            node_valid = node_features[..., -1] == 1
+            if self.compact:
+                edge_valid = self.unpack_mask(observations['edge_mask'], max_edges) == 1
+            else:
+                edge_valid = observations['edge_attr'][..., -1] == 1
+        return node_valid, edge_valid
+
+    def batch_graphs(self, node_features, edge_index, node_valid, edge_valid):
+        """
+        Concatenate the valid nodes of every observation into one graph for message passing, with the valid
+        edges between them renumbered over the kept nodes, and the batch vector mapping nodes to observations.
+        """
+        batch_size, max_nodes = node_valid.shape
+        node_offsets, padded_batch, _, _ = self.graph_batch_layout(batch_size, max_nodes, edge_index.shape[2], node_features.device)
+        node_valid = node_valid.view(-1)
+        new_node_idx = torch.cumsum(node_valid, 0) - 1
+        edge_index = (edge_index.long() + node_offsets).transpose(0, 1).reshape(2, -1)
+        edge_valid = edge_valid.view(-1) & node_valid[edge_index[0]] & node_valid[edge_index[1]]
+        x = node_features.view(batch_size * max_nodes, -1)[node_valid]
+        return x, new_node_idx[edge_index[:, edge_valid]], padded_batch[node_valid]
+
+    def unpack_mask(self, packed, size):
+        """Inverse of np.packbits over the last dimension, returning the first size bits as floats."""
+        bits = (packed.to(torch.uint8).unsqueeze(-1) >> self.mask_bit_shifts) & 1
+        return bits.flatten(-2)[..., :size].to(torch_dtype)
+
     def _initialize_weights(self):
         """
         Initializes the weights of the model using Kaiming normalization.
@@ -361,3 +455,23 @@ class AgentModel(BaseFeaturesExtractor):
             print(f"Output std: {output.std().item():.4f}")
             print(f"Vision features mean: {self.vision_processor(observations['vision']).mean().item():.4f}")
             print(f"Graph features mean: {self.graph_processor(Data(x=observations['node_features'].to(torch_dtype), edge_index=observations['edge_index'].long(), edge_attr=observations['edge_attr'].to(torch_dtype), batch=torch.zeros(observations['node_features'].shape[0], dtype=torch.long))).mean().item():.4f}")
+
+
+class CompactMultiInputPolicy(MultiInputActorCriticPolicy):
+    """
+    MultiInputPolicy for compact observations. SB3 casts observations to float before the features
+    extractor, this policy passes them through unchanged so that AgentModel does the upcast.
+    """
+    def extract_features(self, obs, features_extractor=None):
+        if self.share_features_extractor:
+            return (self.features_extractor if features_extractor is None else features_extractor)(obs)
+        return self.pi_features_extractor(obs), self.vf_features_extractor(obs)
+
+
+class CompactDictRolloutBuffer(DictRolloutBuffer):
+    """DictRolloutBuffer that stores observations in the dtypes of the observation space instead of float32."""
+    def reset(self):
+        super().reset()
+        for key, obs_input_shape in self.obs_shape.items():
+            dtype = self.observation_space.spaces[key].dtype
+            self.observations[key] = np.zeros((self.buffer_size, self.n_envs, *obs_input_shape), dtype=dtype)
@@ -0,0 +1,672 @@
+import os
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pygame
+import torch
+from torch_geometric.data import Data
+from torch_geometric.utils import k_hop_subgraph
+
+from heightmap_generator import HeightmapGenerator
+from environment import Environment
+from knowledge_graph import KnowledgeGraph
+from graph_idx_manager import Grid_Graph_Manager
+from stable_baselines3.common.buffers import DictRolloutBuffer
+from agent_model import CompactDictRolloutBuffer
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # Benchmarks that build a CustomEnv do not need a window
+
+#####################################################################################
+#   Micro-benchmarks for the simulation hot paths. Run from the repository root:   #
+#   python benchmarks.py [benchmark_name ...]                                       #
+#####################################################################################
+
+def build_environment(num_tiles, tile_size=4, seed=0):
+    """Generate a world with the same heightmap parameters as the GameManager."""
+    random.seed(seed)
+    np.random.seed(seed)
+    heightmap_generator = HeightmapGenerator(
+        width=num_tiles,
+        height=num_tiles,
+        scale=10,
+        terrain_thresholds=np.array([0.1, 0.2, 0.5, 0.7, 0.9, 1.0]),
+        octaves=3, persistence=0.2, lacunarity=2.0
+    )
+    return Environment(heightmap_generator.generate(), tile_size, number_of_outposts=3)
+
+def time_call(func, repeats):
+    """Return the mean wall-clock time of func() in seconds."""
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - start_time) / repeats
+
+def print_table(header, rows):
+    print(' | '.join(f'{column:>14}' for column in header))
+    for row in rows:
+        print(' | '.join(f'{value:>14.3f}' if isinstance(value, float) else f'{value:>14}' for value in row))
+
+def benchmark_incidence_lookup(map_sizes=(8, 16, 32, 64), lookups=200):
+    """Per-node edge lookups: full scan of the edge dictionary vs the CSR incidence index."""
+    rows = []
+    for num_tiles in map_sizes:
+        kg = KnowledgeGraph(build_environment(num_tiles), vision_range=1, completion=1.0, indexing='dict')
+        graph_manager = kg.graph_manager
+        nodes = [random.randrange(1, kg.num_possible_nodes) for _ in range(lookups)]
+        edge_dict = graph_manager.nodeTuples_edgeIdx_dict
+
+        def scan():
+            for node_idx in nodes:
+                [edge_dict[edge] for edge in edge_dict if node_idx in edge]
+
+        def indexed():
+            for node_idx in nodes:
+                graph_manager.retrieve_edge_indicies_from_node(node_idx)
+
+        scan_time = time_call(scan, 1) / lookups
+        indexed_time = time_call(indexed, 5) / lookups
+        rows.append((num_tiles, kg.num_possible_edges, scan_time * 1e6, indexed_time * 1e6, scan_time / indexed_time))
+    print_table(('num_tiles', 'edges', 'scan us', 'index us', 'speed-up'), rows)
+
+def retained_bytes(factory):
+    """Return the object built by factory() and the number of bytes it keeps allocated."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = factory()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, retained
+
+def benchmark_index_memory(map_sizes=(8, 16, 32, 64)):
+    """Memory held by the node/edge index of one world: dictionaries vs the closed-form grid layout."""
+    rows = []
+    for num_tiles in map_sizes:
+        sizes = []
+        for indexing in ('dict', 'grid'):
+            kg = KnowledgeGraph(build_environment(num_tiles), vision_range=1, completion=1.0, indexing=indexing)
+            _, graph_manager_bytes = retained_bytes(lambda: pickle.loads(pickle.dumps(kg.graph_manager)))
+            sizes.append(graph_manager_bytes / 1024)
+        rows.append((num_tiles, sizes[0], sizes[1], sizes[0] / sizes[1]))
+    print_table(('num_tiles', 'dict KiB', 'grid KiB', 'reduction'), rows)
+
+def benchmark_kg_construction(map_sizes=(5, 8, 16, 32, 64, 128), loop_size_limit=64, repeats=3):
+    """KnowledgeGraph construction time: per-node/per-edge loops vs the batch builder."""
+    rows = []
+    for num_tiles in map_sizes:
+        environment = build_environment(num_tiles)
+        times = []
+        for indexing in ('dict', 'grid'):
+            if indexing == 'dict' and num_tiles > loop_size_limit:
+                times.append(float('nan'))
+                continue
+            times.append(time_call(lambda: KnowledgeGraph(environment, vision_range=1, completion=0.5, indexing=indexing), repeats))
+        rows.append((num_tiles, times[0] * 1e3, times[1] * 1e3, times[0] / times[1]))
+    print_table(('num_tiles', 'loops ms', 'batch ms', 'speed-up'), rows)
+
+def benchmark_subgraph_extraction(map_sizes=(8, 16, 32, 64), distances=(1, 2, 4, 8), positions=50):
+    """Observation subgraph extraction: k-hop BFS vs coordinate windows (first visit and cached)."""
+    rows = []
+    for num_tiles in map_sizes:
+        graph_manager = Grid_Graph_Manager(num_tiles, num_tiles)
+        edge_index = graph_manager.edge_nodes_tensor
+        centers = [(random.randrange(num_tiles), random.randrange(num_tiles)) for _ in range(positions)]
+        for distance in distances:
+            def khop():
+                for center in centers:
+                    k_hop_subgraph(graph_manager.get_node_idx(center, 0), distance, edge_index, relabel_nodes=True)
+
+            def window():
+                for center in centers:
+                    graph_manager.get_window(center, distance, 'manhattan')
+
+            graph_manager.topology.window_cache.clear()
+            khop_time = time_call(khop, 1) / positions
+            cold_time = time_call(window, 1) / positions
+            cached_time = time_call(window, 5) / positions
+            rows.append((num_tiles, distance, khop_time * 1e6, cold_time * 1e6, cached_time * 1e6, khop_time / cold_time))
+    print_table(('num_tiles', 'distance', 'k-hop us', 'window us', 'cached us', 'speed-up'), rows)
+
+def array_buffers(obj, buffers, visited):
+    """Collect the (address, bytes) of every tensor and array buffer reachable from obj."""
+    if id(obj) in visited:
+        return
+    visited.add(id(obj))
+    if isinstance(obj, torch.Tensor):
+        buffers[obj.untyped_storage().data_ptr()] = obj.untyped_storage().nbytes()
+    elif isinstance(obj, np.ndarray):
+        base = obj if obj.base is None else obj.base
+        if isinstance(base, np.ndarray):
+            buffers[base.ctypes.data] = base.nbytes
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            array_buffers(item, buffers, visited)
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            array_buffers(item, buffers, visited)
+    elif isinstance(obj, (KnowledgeGraph, Data)) or type(obj).__module__ == 'graph_idx_manager':
+        array_buffers(obj.__dict__ if not isinstance(obj, Data) else obj.to_dict(), buffers, visited)
+
+def benchmark_world_memory(map_sizes=(8, 16, 32, 64), num_worlds=8):
+    """Tensor and array memory of the knowledge graphs of several worlds of the same size, shared buffers counted once."""
+    rows = []
+    for num_tiles in map_sizes:
+        kgs = [KnowledgeGraph(build_environment(num_tiles, seed=seed), vision_range=1, completion=0.5) for seed in range(num_worlds)]
+        for kg in kgs:
+            kg.get_subgraph()
+        per_world = [{} for _ in kgs]
+        for kg, buffers in zip(kgs, per_world):
+            array_buffers(kg, buffers, set())
+        all_buffers = {address: nbytes for buffers in per_world for address, nbytes in buffers.items()}
+        shared = set(per_world[0]).intersection(*per_world[1:])
+        shared_bytes = sum(all_buffers[address] for address in shared)
+        owned_bytes = (sum(all_buffers.values()) - shared_bytes) / num_worlds
+        rows.append((num_tiles, num_worlds, owned_bytes / 1024, shared_bytes / 1024, sum(all_buffers.values()) / 1024))
+    print_table(('num_tiles', 'worlds', 'own KiB/world', 'shared KiB', 'total KiB'), rows)
+
+def benchmark_region_discovery(map_sizes=(16, 32, 64), radii=(2, 4, 8), scouts=20):
+    """Scouting undiscovered regions: discover_this_coordinate per tile vs one discover_region call."""
+    rows = []
+    for num_tiles in map_sizes:
+        environment = build_environment(num_tiles)
+        for radius in radii:
+            centers = [(random.randrange(num_tiles), random.randrange(num_tiles)) for _ in range(scouts)]
+            times = []
+            for per_tile in (True, False):
+                kg = KnowledgeGraph(environment, vision_range=1, completion=0.0)
+                masks = [kg.get_region_mask(center, radius) for center in centers]
+
+                def scout():
+                    for mask in masks:
+                        if per_tile:
+                            for x, y in zip(*np.nonzero(mask)):
+                                kg.discover_this_coordinate(x, y)
+                        else:
+                            kg.discover_region(mask)
+                times.append(time_call(scout, 1) / scouts)
+            rows.append((num_tiles, radius, times[0] * 1e3, times[1] * 1e3, times[0] / times[1]))
+    print_table(('num_tiles', 'radius', 'per tile ms', 'region ms', 'speed-up'), rows)
+
+def benchmark_world_reset(map_sizes=(8, 16, 32, 64), episodes=10, steps=200):
+    """Per-episode reset of a world: rebuilding the knowledge graph vs restoring the snapshots, and switching completeness."""
+    from game_manager import GameManager
+    rows = []
+    for num_tiles in map_sizes:
+        random.seed(0)
+        np.random.seed(0)
+        game_manager = GameManager(num_tiles, num_tiles * 4, vision_range=1)
+        game_manager.reset_world(0.5)
+        rebuild_time = time_call(lambda: game_manager.init_knowledge_graph(0.5), episodes)
+        game_manager.reset_world(0.5)
+        restore_time = 0.0
+        for _ in range(episodes):
+            for _ in range(steps):
+                game_manager.agent_controler.agent_action(random.randint(0, 10))
+            restore_time += time_call(lambda: game_manager.reset_world(0.5), 1) / episodes
+        completeness = iter([0.25, 1.0] * episodes)
+        switch_time = time_call(lambda: game_manager.kg_class.set_completeness(next(completeness)), 2 * episodes)
+        rows.append((num_tiles, rebuild_time * 1e3, restore_time * 1e3, rebuild_time / restore_time, switch_time * 1e3))
+    print(f'Restore after {steps} random actions')
+    print_table(('num_tiles', 'rebuild ms', 'restore ms', 'speed-up', 'switch ms'), rows)
+
+def benchmark_compact_memory(map_sizes=(5, 8, 16, 32), n_steps=4096):
+    """Knowledge graph bytes per world and rollout buffer observation bytes: int32/float32 vs compact dtypes."""
+    from custom_env import CustomEnv
+    rows = []
+    for num_tiles in map_sizes:
+        world_bytes, rollout_bytes = [], []
+        for compact in (False, True):
+            kg = KnowledgeGraph(build_environment(num_tiles), vision_range=1, completion=0.5, compact=compact)
+            world_bytes.append(sum(tensor.element_size() * tensor.nelement() for tensor in (kg.graph.x, kg.graph.edge_attr)))
+            env = CustomEnv({'num_tiles': num_tiles, 'screen_size': num_tiles * 4, 'vision_range': 1, 'compact': compact},
+                            {'number_of_environments': 4, 'number_of_curricula': 1, 'min_episodes_per_curriculum': 1},
+                            {'num_actions': 11})
+            buffer_class = CompactDictRolloutBuffer if compact else DictRolloutBuffer
+            buffer = buffer_class(n_steps, env.observation_space, env.action_space, device='cpu')
+            rollout_bytes.append(sum(observations.nbytes for observations in buffer.observations.values()))
+        rows.append((num_tiles, world_bytes[0] / 1024, world_bytes[1] / 1024, world_bytes[0] / world_bytes[1],
+                     rollout_bytes[0] / 2**20, rollout_bytes[1] / 2**20, rollout_bytes[0] / rollout_bytes[1]))
+    print(f'Rollout of {n_steps} steps, one environment')
+    print_table(('num_tiles', 'world KiB', 'compact KiB', 'reduction', 'rollout MiB', 'compact MiB', 'reduction'), rows)
+
+def benchmark_world_state(map_sizes=(8, 16, 32, 64), tile_size=25, repeats=20):
+    """Memory of a world's terrain (tile objects, their images, state arrays) and reading its energy grid."""
+    rows = []
+    for num_tiles in map_sizes:
+        tracemalloc.start()
+        environment = build_environment(num_tiles, tile_size)
+        python_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tiles = environment.terrain_object_grid.ravel()
+        images = {id(tile.image): tile.image for tile in tiles}.values()
+        image_bytes = sum(image.get_width() * image.get_height() * image.get_bytesize() for image in images)
+        array_bytes = sum(array.nbytes for array in (environment.passable, environment.energy_requirement, environment.elevation))
+        per_tile = time_call(lambda: np.array([tile.energy_requirement for tile in tiles]), repeats)
+        array = time_call(lambda: environment.energy_requirement.copy(), repeats)
+        rows.append((num_tiles, python_bytes / 1024, image_bytes / 1024, array_bytes / 1024, per_tile * 1e3, array * 1e3))
+    print(f'Tiles of {tile_size} pixels, python KiB includes the entity sprites')
+    print_table(('num_tiles', 'python KiB', 'image KiB', 'array KiB', 'per tile ms', 'array ms'), rows)
+
+def benchmark_headless_steps(map_sizes=(8, 16, 32), tile_size=8, steps=500):
+    """CustomEnv steps and resets per second with the pygame display vs headless with the vision rasterizer."""
+    from custom_env import CustomEnv
+    rows = []
+    for num_tiles in map_sizes:
+        rates = []
+        for headless in (False, True):
+            random.seed(0)
+            np.random.seed(0)
+            env = CustomEnv({'num_tiles': num_tiles, 'screen_size': num_tiles * tile_size, 'vision_range': 2,
+                             'compact': True, 'headless': headless},
+                            {'number_of_environments': 8, 'number_of_curricula': 1, 'min_episodes_per_curriculum': 1},
+                            {'num_actions': 11})
+            env.reset()
+            rng = random.Random(0)
+            rates.append(1 / time_call(lambda: env.step(rng.randrange(11)), steps))
+            rates.append(1 / time_call(lambda: env.current_gm.start_game(env.kg_completeness), 20))
+        rows.append((num_tiles, rates[0], rates[2], rates[2] / rates[0], rates[1], rates[3]))
+    print(f'Tiles of {tile_size} pixels, vision range 2, compact observations')
+    print_table(('num_tiles', 'display step/s', 'headless step/s', 'speed-up', 'display reset/s', 'headless reset/s'), rows)
+
+def benchmark_vision_rasterizer(tile_sizes=(4, 8, 16), vision_ranges=(1, 2, 4), num_tiles=16, frames=500):
+    """Vision observation: pygame display crop to float16 (C, W, H) vs the atlas rasterizer, uint8 and normalised float16."""
+    from game_manager import GameManager
+    rows = []
+    for tile_size in tile_sizes:
+        for vision_range in vision_ranges:
+            random.seed(0)
+            np.random.seed(0)
+            game_manager = GameManager(num_tiles, num_tiles * tile_size, vision_range)
+            game_manager.start_game(0.5)
+            rasterizer = game_manager.get_rasterizer()
+            side = (2 * vision_range + 1) * tile_size
+            surface = game_manager.renderer.surface
+
+            def display():
+                player = game_manager.environment.player
+                rect = pygame.Rect((player.grid_x - vision_range) * tile_size, (player.grid_y - vision_range) * tile_size, side, side)
+                rect.clamp_ip(surface.get_rect())
+                vision = np.transpose(pygame.surfarray.array3d(surface.subsurface(rect)).astype(np.float16), (2, 0, 1))
+                return vision / 255.0
+
+            times = [time_call(display, frames), time_call(rasterizer.render, frames),
+                     time_call(lambda: rasterizer.render(normalised=True), frames)]
+            rows.append((tile_size, vision_range, side, 1 / times[0], 1 / times[1], 1 / times[2], times[0] / times[2]))
+    print(f'{num_tiles}x{num_tiles} world, frames per second')
+    print_table(('tile_size', 'vision_range', 'side px', 'display f/s', 'atlas f/s', 'atlas f16 f/s', 'speed-up f16'), rows)
+
+def count_macs(module, inputs):
+    """Multiply-accumulates of the Conv2d and Linear layers of module for one sample of inputs."""
+    macs = []
+
+    def hook(layer, layer_inputs, output):
+        if isinstance(layer, torch.nn.Conv2d):
+            macs.append(output[0].numel() * layer.in_channels * layer.kernel_size[0] * layer.kernel_size[1] // layer.groups)
+        else:
+            macs.append(layer.in_features * layer.out_features)
+    handles = [layer.register_forward_hook(hook) for layer in module.modules() if isinstance(layer, (torch.nn.Conv2d, torch.nn.Linear))]
+    with torch.no_grad():
+        module(inputs[:1])
+    for handle in handles:
+        handle.remove()
+    return sum(macs)
+
+def benchmark_symbolic_vision(vision_ranges=(1, 2, 4, 8), tile_size=4, batch_size=64, n_steps=4096, repeats=5, max_weights=2**27):
+    """
+    Pixel vision with VisionProcessor vs symbolic one-hot vision with SymbolicVisionProcessor. Pixel models
+    whose first fully connected layer has more than max_weights weights are not built.
+    """
+    from agent_model import VisionProcessor, SymbolicVisionProcessor
+    from renderer import Vision_Rasterizer
+    vision_params = {'num_conv_layers': 4, 'conv_channels': [64, 128, 256, 512], 'fc_dims': [512]}  # As in AgentModel
+    rows = []
+    for vision_range in vision_ranges:
+        window_tiles = 2 * vision_range + 1
+        side = window_tiles * tile_size
+        pixel_shape = (3, side, side)
+        symbolic_shape = (Vision_Rasterizer.num_symbolic_channels, window_tiles, window_tiles)
+        pixel_weights = vision_params['conv_channels'][-1] * side * side * vision_params['fc_dims'][0]
+        models = [(SymbolicVisionProcessor, symbolic_shape, None)]
+        if pixel_weights <= max_weights:
+            models.insert(0, (VisionProcessor, pixel_shape, vision_params))
+        results = []
+        for processor_class, shape, params in models:
+            processor = processor_class(shape, params)
+            processor.eval()
+            inputs = torch.rand(batch_size, *shape)
+            with torch.no_grad():
+                forward = time_call(lambda: processor(inputs), repeats)
+            results.append((count_macs(processor, inputs) / 1e6, forward * 1e3))
+        if len(results) == 1:
+            results.insert(0, ('too large', 'too large'))
+        (pixel_macs, pixel_time), (symbol_macs, symbol_time) = results
+        pixel_bytes, symbol_bytes = int(np.prod(pixel_shape)), int(np.prod(symbolic_shape))
+        rows.append((vision_range, pixel_bytes, symbol_bytes, pixel_bytes * n_steps / 2**20, symbol_bytes * n_steps / 2**20,
+                     pixel_macs, symbol_macs, pixel_time, symbol_time))
+    print(f'Tiles of {tile_size} pixels, uint8 observations, rollout of {n_steps} steps, forward pass of a batch of {batch_size}')
+    print_table(('vision_range', 'pixel B', 'symbolic B', 'pixel MiB', 'symbolic MiB', 'pixel MMAC', 'symbolic MMAC', 'pixel ms', 'symbolic ms'), rows)
+
+def benchmark_observation_buffers(map_sizes=(8, 16, 32), steps=300):
+    """Memory allocated while building one observation (tracemalloc peak) and observation and step latency, with and without copy_observations."""
+    from custom_env import CustomEnv
+    rows = []
+    for num_tiles in map_sizes:
+        for compact, copy in ((False, True), (True, True), (True, False)):
+            random.seed(0)
+            np.random.seed(0)
+            env = CustomEnv({'num_tiles': num_tiles, 'screen_size': num_tiles * 8, 'vision_range': 2,
+                             'compact': compact, 'headless': True},
+                            {'number_of_environments': 4, 'number_of_curricula': 1, 'min_episodes_per_curriculum': 1},
+                            {'num_actions': 11}, copy_observations=copy)
+            env.reset()
+            rng = random.Random(0)
+            step = time_call(lambda: env.step(rng.randrange(11)), steps)
+            observation = time_call(env._get_observation, steps)
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            returned = env._get_observation()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            returned_bytes = sum(array.nbytes for array in returned.values())
+            rows.append((num_tiles, str(compact), str(copy), peak_bytes / 1024, returned_bytes / 1024, observation * 1e3, step * 1e3))
+    print('Headless, vision range 2, tiles of 8 pixels')
+    print_table(('num_tiles', 'compact', 'copy', 'peak KiB', 'returned KiB', 'observation ms', 'step ms'), rows)
+
+def benchmark_active_graph(completeness_values=(0.25, 0.5, 1.0), num_tiles=16, vision_range=2, batch_size=64, repeats=5):
+    """
+    Padded vs active graph observations of the same states: node and edge rows per observation and AgentModel forward
+    time. Both formats must give the same valid nodes and edges to message passing (AgentModel.batch_graphs).
+    """
+    from custom_env import CustomEnv
+    from agent_model import AgentModel
+    rows = []
+    for completeness in completeness_values:
+        results = []
+        graphs = []
+        for active_graph in (False, True):
+            random.seed(0)
+            np.random.seed(0)
+            torch.manual_seed(0)
+            env = CustomEnv({'num_tiles': num_tiles, 'screen_size': num_tiles * 4, 'vision_range': vision_range,
+                             'headless': True, 'vision_mode': 'symbolic', 'active_graph': active_graph},
+                            {'number_of_environments': 4, 'number_of_curricula': 1, 'min_episodes_per_curriculum': 1},
+                            {'num_actions': 11})
+            env.set_kg_completeness(completeness)
+            env.reset()
+            rng = random.Random(0)
+            observations = [env.step(rng.randrange(11))[0] for _ in range(batch_size)]
+            batch = {key: torch.as_tensor(np.stack([observation[key] for observation in observations])).float()
+                     for key in observations[0]}
+            if active_graph:
+                nodes, edges = batch['num_nodes'].mean().item(), batch['num_edges'].mean().item()
+            else:
+                nodes, edges = batch['node_features'].shape[1], batch['edge_index'].shape[2]
+            model = AgentModel(env.observation_space, features_dim=64, vision_mode=env.vision_mode)
+            model.eval()
+            node_valid, edge_valid = model.get_valid_masks(batch['node_features'], batch)
+            graphs.append(model.batch_graphs(batch['node_features'], batch['edge_index'], node_valid, edge_valid))
+            with torch.no_grad():
+                forward = time_call(lambda: model(batch), repeats)
+            results.append((nodes, edges, forward * 1e3))
+        assert all(torch.equal(padded, active) for padded, active in zip(*graphs)), \
+            f"Padded and active observations batch differently at completeness {completeness}"
+        (padded_nodes, padded_edges, padded_time), (active_nodes, active_edges, active_time) = results
+        rows.append((completeness, padded_nodes, active_nodes, padded_edges, active_edges, graphs[0][1].shape[1] / batch_size,
+                     padded_time, active_time))
+    print(f'{num_tiles}x{num_tiles} worlds, vision range {vision_range}, symbolic vision, mean rows per observation, forward pass of a batch of {batch_size}')
+    print_table(('completeness', 'padded nodes', 'active nodes', 'padded edges', 'active edges', 'valid edges', 'padded ms', 'active ms'), rows)
+
+def benchmark_graph_batching(completeness_values=(0.25, 0.5, 1.0), num_tiles=8, vision_range=2, batch_size=512, repeats=3):
+    """
+    Forward and backward pass of the GraphProcessor of AgentModel over a batch of padded graph observations
+    (SB3's batch_size) on CPU: every padded row vs only the valid nodes and edges (AgentModel.batch_graphs).
+    """
+    from custom_env import CustomEnv
+    from agent_model import AgentModel
+    rows = []
+    for completeness in completeness_values:
+        random.seed(0)
+        np.random.seed(0)
+        torch.manual_seed(0)
+        env = CustomEnv({'num_tiles': num_tiles, 'screen_size': num_tiles * 4, 'vision_range': vision_range,
+                         'headless': True, 'vision_mode': 'symbolic'},
+                        {'number_of_environments': 4, 'number_of_curricula': 1, 'min_episodes_per_curriculum': 1},
+                        {'num_actions': 11})
+        env.set_kg_completeness(completeness)
+        env.reset()
+        rng = random.Random(0)
+        observations = [env.step(rng.randrange(11))[0] for _ in range(batch_size)]
+        batch = {key: torch.as_tensor(np.stack([observation[key] for observation in observations])).float()
+                 for key in observations[0]}
+        model = AgentModel(env.observation_space, features_dim=64, vision_mode=env.vision_mode)
+        node_features, edge_index = batch['node_features'], batch['edge_index']
+        max_nodes = node_features.shape[1]
+
+        def padded():
+            x = node_features.view(batch_size * max_nodes, -1)
+            edges = (edge_index.long() + (torch.arange(batch_size) * max_nodes).view(-1, 1, 1)).transpose(0, 1).reshape(2, -1)
+            graph_batch = torch.arange(batch_size).repeat_interleave(max_nodes)
+            model.graph_processor(x, edges, graph_batch, batch_size).sum().backward()
+
+        def valid_only():
+            node_valid, edge_valid = model.get_valid_masks(node_features, batch)
+            x, edges, graph_batch = model.batch_graphs(node_features, edge_index, node_valid, edge_valid)
+            model.graph_processor(x, edges, graph_batch, batch_size).sum().backward()
+
+        node_valid, edge_valid = model.get_valid_masks(node_features, batch)
+        valid_nodes, valid_edges = model.batch_graphs(node_features, edge_index, node_valid, edge_valid)[:2]
+        rows.append((completeness, batch_size * max_nodes, valid_nodes.shape[0], batch_size * edge_index.shape[2], valid_edges.shape[1],
+                     time_call(padded, repeats) * 1e3, time_call(valid_only, repeats) * 1e3))
+    print(f'{num_tiles}x{num_tiles} worlds, vision range {vision_range}, batch of {batch_size}, rows over the whole batch')
+    print_table(('completeness', 'padded nodes', 'valid nodes', 'padded edges', 'valid edges', 'padded ms', 'valid ms'), rows)
+
+def benchmark_least_energy_path(map_sizes=(32, 64, 128, 256), pairs=10):
+    """Least energy path between random cells with Dijkstra and with A* (Target_Manager.least_energy_search)."""
+    from target import Target_Manager
+    rows = []
+    for num_tiles in map_sizes:
+        environment = build_environment(num_tiles)
+        target_manager = Target_Manager(environment)
+        rng = random.Random(0)
+        legs = [((rng.randrange(num_tiles), rng.randrange(num_tiles)), (rng.randrange(num_tiles), rng.randrange(num_tiles)))
+                for _ in range(pairs)]
+        results = []
+        for heuristic in (False, True):
+            start_time = time.perf_counter()
+            energies = [target_manager.calculate_path_energy(start, end, heuristic) for start, end in legs]
+            results.append(((time.perf_counter() - start_time) / pairs, energies))
+        (dijkstra, dijkstra_energies), (astar, astar_energies) = results
+        rows.append((num_tiles, dijkstra * 1e3, astar * 1e3, str(dijkstra_energies == astar_energies)))
+    print(f'Mean of {pairs} random start and end cells')
+    print_table(('num_tiles', 'dijkstra ms', 'A* ms', 'same energy'), rows)
+
+def benchmark_outpost_energy(map_sizes=(5, 16, 32, 64, 128), worlds=10):
+    """All-pairs outpost energies from one batched Dijkstra (Target_Manager.compute_outpost_distances) vs a search per pair."""
+    from target import Target_Manager
+    rows = []
+    for num_tiles in map_sizes:
+        batched = per_pair = 0.0
+        for seed in range(worlds):
+            environment = build_environment(num_tiles, seed=seed)
+            target_manager = Target_Manager(environment)
+            outposts = environment.outpost_locations
+            start_time = time.perf_counter()
+            target_manager.compute_outpost_distances()
+            matrix = target_manager.get_outpost_energy_matrix()
+            batched += time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            pairs = [[target_manager.calculate_path_energy(start, end) for end in outposts] for start in outposts]
+            per_pair += time.perf_counter() - start_time
+            assert np.array_equal(matrix, pairs)
+        rows.append((num_tiles, per_pair / worlds * 1e3, batched / worlds * 1e3))
+    print(f'Mean over {worlds} worlds with 3 outposts')
+    print_table(('num_tiles', 'per pair ms', 'batched ms'), rows)
+
+def benchmark_trade_route(outpost_counts=(3, 5, 8, 10, 12, 15, 20, 30, 50), num_tiles=32, worlds=3):
+    """
+    Trade route planning on the outpost energy matrix: exact Held-Karp (up to Target_Manager.held_karp_max_outposts)
+    and 2-opt/Or-opt local search, with the local search gap to the optimum and the time to build the world and its
+    Target_Manager.
+    """
+    from target import Target_Manager, held_karp_tour, local_search_tour
+    rows = []
+    for number_of_outposts in outpost_counts:
+        exact = local = build = gap = 0.0
+        for seed in range(worlds):
+            random.seed(seed)
+            np.random.seed(seed)
+            start_time = time.perf_counter()
+            heightmap = HeightmapGenerator(width=num_tiles, height=num_tiles, scale=10,
+                                           terrain_thresholds=np.array([0.1, 0.2, 0.5, 0.7, 0.9, 1.0]),
+                                           octaves=3, persistence=0.2, lacunarity=2.0).generate()
+            environment = Environment(heightmap, 4, number_of_outposts=number_of_outposts, headless=True)
+            target_manager = Target_Manager(environment)
+            build += time.perf_counter() - start_time
+            energy = target_manager.outpost_energy
+            start_time = time.perf_counter()
+            local_energy = local_search_tour(energy)[1]
+            local += time.perf_counter() - start_time
+            if number_of_outposts <= Target_Manager.held_karp_max_outposts:
+                start_time = time.perf_counter()
+                exact_energy = held_karp_tour(energy)[1]
+                exact += time.perf_counter() - start_time
+                gap += (local_energy / exact_energy - 1) * 100 if exact_energy else 0.0
+        if number_of_outposts <= Target_Manager.held_karp_max_outposts:
+            exact_row = (exact / worlds * 1e3, gap / worlds)
+        else:
+            exact_row = ('-', '-')
+        rows.append((number_of_outposts, *exact_row, local / worlds * 1e3, build / worlds * 1e3))
+    print(f'{num_tiles}x{num_tiles} headless worlds, mean over {worlds} worlds')
+    print_table(('outposts', 'held-karp ms', 'local gap %', 'local ms', 'world ms'), rows)
+
+def benchmark_route_energy_updates(map_sizes=(16, 32, 64, 128), changes=100):
+    """
+    Keeping the outpost energies up to date as tiles change energy (a wood path lowering a random tile by 2, as in
+    Terrain.add_path), read after every change: repairing the distance fields vs recomputing them all.
+    """
+    from target import Target_Manager
+    rows = []
+    for num_tiles in map_sizes:
+        environment = build_environment(num_tiles)
+        target_manager = Target_Manager(environment)
+        rng = random.Random(0)
+        tiles = [(rng.randrange(num_tiles), rng.randrange(num_tiles)) for _ in range(changes)]
+        start_time = time.perf_counter()
+        for x, y in tiles:
+            terrain = environment.terrain_object_grid[x, y]
+            terrain.energy_requirement = max(0, terrain.energy_requirement - 2)
+            target_manager.target_route_energy  # Repairs the distance fields
+        incremental = (time.perf_counter() - start_time) / changes
+        start_time = time.perf_counter()
+        for _ in range(10):
+            target_manager.compute_outpost_distances()
+            target_manager.get_outpost_energy_matrix()
+            target_manager.get_target_trade_route()
+        full = (time.perf_counter() - start_time) / 10
+        rows.append((num_tiles, full * 1e3, incremental * 1e3))
+    print(f'Mean over {changes} tile changes, 3 outposts')
+    print_table(('num_tiles', 'recompute ms', 'incremental ms'), rows)
+
+def benchmark_outpost_shaping(map_sizes=(16, 32, 64, 128), steps=2000):
+    """
+    Energy from the agent to the nearest unvisited outpost, as read every step by the reward shaping and the progress
+    check: a search to each unvisited outpost vs a lookup in Target_Manager.get_nearest_outpost_energy, with the
+    Manhattan distance the shaping used before for reference.
+    """
+    from target import Target_Manager
+    rows = []
+    for num_tiles in map_sizes:
+        environment = build_environment(num_tiles)
+        target_manager = Target_Manager(environment)
+        outposts = environment.outpost_locations
+        rng = random.Random(0)
+        positions = [(rng.randrange(num_tiles), rng.randrange(num_tiles)) for _ in range(steps)]
+        visited_mask = 1  # First outpost visited
+        unvisited = [outpost for index, outpost in enumerate(outposts) if not visited_mask >> index & 1]
+        start_time = time.perf_counter()
+        manhattan = [min(abs(x - ox) + abs(y - oy) for ox, oy in unvisited) for x, y in positions]
+        manhattan_time = (time.perf_counter() - start_time) / steps
+        searched_positions = positions[:steps // 20]
+        start_time = time.perf_counter()
+        searched = [min(target_manager.calculate_path_energy(position, outpost) for outpost in unvisited) - environment.energy_requirement[position]
+                    for position in searched_positions]
+        search_time = (time.perf_counter() - start_time) / len(searched_positions)
+        target_manager.nearest_outpost_fields.clear()
+        start_time = time.perf_counter()
+        looked_up = [int(target_manager.get_nearest_outpost_energy(visited_mask)[position]) for position in positions]
+        lookup_time = (time.perf_counter() - start_time) / steps
+        assert looked_up[:len(searched)] == searched
+        rows.append((num_tiles, manhattan_time * 1e6, search_time * 1e6, lookup_time * 1e6))
+    print(f'Mean over {steps} agent positions, 3 outposts with one visited, the field built on the first lookup')
+    print_table(('num_tiles', 'manhattan us', 'search us', 'field us'), rows)
+
+def benchmark_world_generation(map_sizes=(5, 16, 32), worker_counts=(1, 2, 4, 8), num_tiles=16, worlds=200):
+    """
+    Parallel world generation (SimulationManager.generate_world_specs). Per world: a GameManager generated serially,
+    generate_world_spec as run by a worker, and a GameManager built over the spec in the main process, which bounds
+    the speed-up to serial / build. Then SimulationManager startup with a pool of workers, only as many workers as
+    there are cores help.
+    """
+    from game_manager import GameManager, generate_world_spec
+    from simulation_manager import SimulationManager
+    rows = []
+    for size in map_sizes:
+        tile_size = 4
+        random.seed(0)
+        serial = min(time_call(lambda: [GameManager(size, size * tile_size, 1, headless=True) for _ in range(worlds // 10)], 1)
+                     for _ in range(3))
+        start_time = time.perf_counter()
+        specs = [generate_world_spec(size, tile_size, 3, seed) for seed in range(worlds // 10)]
+        generate = time.perf_counter() - start_time
+        build = min(time_call(lambda: [GameManager(size, size * tile_size, 1, headless=True, world_spec=spec) for spec in specs], 1)
+                    for _ in range(3))
+        count = worlds // 10
+        rows.append((size, serial / count * 1e3, generate / count * 1e3, build / count * 1e3, serial / build))
+    print(f'Headless worlds, ms per world, best of 3')
+    print_table(('num_tiles', 'serial ms', 'spec ms', 'build ms', 'max speed-up'), rows)
+
+    game_manager_args = {'num_tiles': num_tiles, 'screen_size': num_tiles * 4, 'vision_range': 1, 'compact': True,
+                         'headless': True}
+    rows = []
+    for num_workers in (0, *worker_counts):
+        random.seed(0)
+        start_time = time.perf_counter()
+        if num_workers == 0:
+            SimulationManager(game_manager_args, worlds, number_of_curricula=10)
+        else:
+            SimulationManager(game_manager_args, worlds, number_of_curricula=10, num_workers=num_workers, seed=0)
+        rows.append((num_workers or 'serial', time.perf_counter() - start_time))
+    print(f'{worlds} headless {num_tiles}x{num_tiles} worlds, {os.cpu_count()} cores')
+    print_table(('workers', 'startup s'), rows)
+
+BENCHMARKS = {
+    'incidence_lookup': benchmark_incidence_lookup,
+    'index_memory': benchmark_index_memory,
+    'kg_construction': benchmark_kg_construction,
+    'subgraph_extraction': benchmark_subgraph_extraction,
+    'world_memory': benchmark_world_memory,
+    'compact_memory': benchmark_compact_memory,
+    'region_discovery': benchmark_region_discovery,
+    'world_reset': benchmark_world_reset,
+    'world_state': benchmark_world_state,
+    'headless_steps': benchmark_headless_steps,
+    'vision_rasterizer': benchmark_vision_rasterizer,
+    'symbolic_vision': benchmark_symbolic_vision,
+    'observation_buffers': benchmark_observation_buffers,
+    'active_graph': benchmark_active_graph,
+    'graph_batching': benchmark_graph_batching,
+    'least_energy_path': benchmark_least_energy_path,
+    'outpost_energy': benchmark_outpost_energy,
+    'trade_route': benchmark_trade_route,
+    'route_energy_updates': benchmark_route_energy_updates,
+    'outpost_shaping': benchmark_outpost_shaping,
+    'world_generation': benchmark_world_generation,
+}
+
+if __name__ == '__main__':
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        print(f'--- {name} ---')
+        BENCHMARKS[name]()
@@ -8,12 +8,12 @@ import logging
 from agent import Agent
 from agent_model import AgentModel
 from simulation_manager import SimulationManager
-
-def manhattan_distance(pos1, pos2):
-        return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1])
+from renderer import Vision_Rasterizer
+from helper_functions import should_validate
 
 class CustomEnv(gym.Env):
-    def __init__(self, game_manager_args, simulation_manager_args, model_args, plot=False):
+    def __init__(self, game_manager_args, simulation_manager_args, model_args, plot=False, simulation_manager=None,
+                 copy_observations=True):
         super(CustomEnv, self).__init__()
         self.logger = logging.getLogger(__name__)
         self.logger.info("Initializing CustomEnv")
@@ -51,6 +51,7 @@ class CustomEnv(gym.Env):
         self.agent_steps = 0
         self.current_reward = 0
         self.outposts_visited = set()
+        self.visited_mask = 0  # Bit i set once outpost_coords[i] is visited, see Target_Manager.get_nearest_outpost_energy
         self.recent_path = None  # Will be initialized in reset()
         self.game_worlds_trained_in = 0
         self.max_game_worlds_trained_in = min(100, simulation_manager_args['number_of_environments'] // 2)
@@ -58,16 +59,30 @@ class CustomEnv(gym.Env):
         self.num_actions = model_args['num_actions']
         self.num_tiles = game_manager_args['num_tiles']
         self.screen_size = game_manager_args['screen_size']
-        # self.kg_completeness = game_manager_args['kg_completeness']
+        self.kg_completeness = game_manager_args.get('kg_completeness', 0.5)
         self.vision_range = game_manager_args['vision_range']
+        self.compact = game_manager_args.get('compact', False)
+        self.headless = game_manager_args.get('headless', False)
+        # 'pixels' crops of the rendered world or 'symbolic' one-hot tile ids, see Vision_Rasterizer
+        self.vision_mode = game_manager_args.get('vision_mode', 'pixels')
+        self.copy_observations = copy_observations  # See _get_observation
+        # Only active nodes and edges, followed by padding, with their counts (see KnowledgeGraph.get_active_subgraph)
+        self.active_graph = game_manager_args.get('active_graph', False)
     
-        self.simulation_manager = SimulationManager(
-            game_manager_args,
-            simulation_manager_args['number_of_environments'], 
-            simulation_manager_args['number_of_curricula'],
-            simulation_manager_args['min_episodes_per_curriculum'],
-            plot=plot
-        )
+        # A SimulationManager can be passed in to share one pool of worlds between experiments
+        if simulation_manager is None:
+            simulation_manager = SimulationManager(
+                game_manager_args,
+                simulation_manager_args['number_of_environments'], 
+                simulation_manager_args['number_of_curricula'],
+                simulation_manager_args['min_episodes_per_curriculum'],
+                plot=plot,
+                num_workers=simulation_manager_args.get('num_workers', 1),
+                seed=simulation_manager_args.get('seed')
+            )
+        else:
+            simulation_manager.reset_curriculum()
+        self.simulation_manager = simulation_manager
         
         self.current_game_index = self.simulation_manager.curriculum_indices[0]  # Start with the first curriculum
         self.set_current_game_manager()
@@ -77,19 +92,35 @@ class CustomEnv(gym.Env):
 
         self.vision_pixel_side_size = (2 * self.vision_range + 1) * self.current_gm.tile_size
         vision_shape = (3, self.vision_pixel_side_size, self.vision_pixel_side_size)
-        vision_space = spaces.Box(low=0, high=255, shape=vision_shape, dtype=np.float16)
+        if self.vision_mode == 'symbolic':
+            window_tiles = 2 * self.vision_range + 1
+            symbolic_shape = (Vision_Rasterizer.num_symbolic_channels, window_tiles, window_tiles)
+            vision_space = spaces.Box(low=0, high=1, shape=symbolic_shape, dtype=np.uint8)
+        elif self.compact:
+            vision_space = spaces.Box(low=0, high=255, shape=vision_shape, dtype=np.uint8)
+        else:
+            vision_space = spaces.Box(low=0, high=255, shape=vision_shape, dtype=np.float16)
+        if self.compact:
+            self.observation_space = self.compact_observation_space(vision_space)
+        else:
 
-        # Flatten graph data into fixed-size arrays
-        node_feature_space = spaces.Box(low=0, high=7, shape=(self.max_nodes, self.kg.graph.num_node_features), dtype=np.uint8)
-        edge_attr_space = spaces.Box(low=0, high=1000, shape=(self.max_edges, self.kg.graph.num_edge_features), dtype=np.uint8)
-        edge_index_space = spaces.Box(low=0, high=self.max_nodes-1, shape=(2, self.max_edges), dtype=np.int64)
+            # Flatten graph data into fixed-size arrays
+            node_feature_space = spaces.Box(low=0, high=7, shape=(self.max_nodes, self.kg.graph.num_node_features), dtype=np.uint8)
+            edge_attr_space = spaces.Box(low=0, high=1000, shape=(self.max_edges, self.kg.graph.num_edge_features), dtype=np.uint8)
+            edge_index_space = spaces.Box(low=0, high=self.max_nodes-1, shape=(2, self.max_edges), dtype=np.int64)
 
-        self.observation_space = spaces.Dict({
-            'vision': vision_space,
-            'node_features': node_feature_space,
-            'edge_attr': edge_attr_space,
-            'edge_index': edge_index_space
-        })
+            self.observation_space = spaces.Dict({
+                'vision': vision_space,
+                'node_features': node_feature_space,
+                'edge_attr': edge_attr_space,
+                'edge_index': edge_index_space
+            })
+
+        if self.active_graph:
+            self.observation_space.spaces.update(
+                num_nodes=spaces.Box(low=0, high=self.max_nodes, shape=(1,), dtype=np.int32),
+                num_edges=spaces.Box(low=0, high=self.max_edges, shape=(1,), dtype=np.int32))
+        self.init_observation_buffers()
 
         self.action_space = spaces.Discrete(self.num_actions)
         self.step_count = 0
@@ -104,16 +135,35 @@ class CustomEnv(gym.Env):
         self.total_reward = 0
         self.logger.info("CustomEnv initialized successfully")
 
+    def compact_observation_space(self, vision_space):
+        """
+        Raw uint8 pixels, node features in uint8 and edge distances in int16 without their mask column,
+        node and edge masks packed into bits and edge_index in the smallest integer type that fits.
+        AgentModel unpacks the masks and upcasts everything to float.
+        """
+        self.edge_index_dtype = np.int16 if self.max_nodes <= np.iinfo(np.int16).max + 1 else np.int32
+        num_node_features = self.kg.graph.num_node_features - 1
+        num_edge_features = self.kg.graph.num_edge_features - 1
+        return spaces.Dict({
+            'vision': vision_space,
+            'node_features': spaces.Box(low=0, high=255, shape=(self.max_nodes, num_node_features), dtype=np.uint8),
+            'node_mask': spaces.Box(low=0, high=255, shape=((self.max_nodes + 7) // 8,), dtype=np.uint8),
+            'edge_attr': spaces.Box(low=0, high=2 * self.num_tiles, shape=(self.max_edges, num_edge_features), dtype=np.int16),
+            'edge_mask': spaces.Box(low=0, high=255, shape=((self.max_edges + 7) // 8,), dtype=np.uint8),
+            'edge_index': spaces.Box(low=0, high=self.max_nodes-1, shape=(2, self.max_edges), dtype=self.edge_index_dtype)
+        })
+
     def set_kg_completeness(self, completeness):
         self.logger.info(f"Setting KG completeness to {completeness} using SimulationManager")
         self.kg_completeness = completeness
+        self.kg.set_completeness(completeness)
 
     def set_current_game_manager(self):
         self.logger.info(f"Setting current game manager to index {self.current_game_index}")
         print(f'Current game index: {self.current_game_index}')
 
         self.current_gm = self.simulation_manager.game_managers[self.current_game_index]
-        self.current_gm.start_game()
+        self.current_gm.start_game(self.kg_completeness)
         self.environment = self.current_gm.environment
         self.agent_controler: Agent = self.current_gm.agent_controler
         self.agent_controler.reset_agent()
@@ -121,6 +171,7 @@ class CustomEnv(gym.Env):
         self.best_efficiency = 0
         self.kg = self.current_gm.kg_class
         self.outpost_coords = self.environment.outpost_locations
+        self.all_visited_mask = (1 << len(self.outpost_coords)) - 1
         self.logger.info("Current game manager set successfully")
 
     def reset(self, seed=None, options=None):
@@ -128,6 +179,7 @@ class CustomEnv(gym.Env):
         self.episode_step = 0
         self.total_reward = 0
         self.outposts_visited.clear()
+        self.visited_mask = 0
         self.early_stop = False
         self.step_count = 0
         self.steps_without_progress = 0
@@ -151,10 +203,20 @@ class CustomEnv(gym.Env):
         
         observation = self._get_observation()
         
-        assert self.observation_space['vision'].contains(observation['vision']), f"Vision data out of bounds: min={observation['vision'].min()}, max={observation['vision'].max()}"
+        if should_validate('cheap'):
+            self.validate_vision(observation)
         
         return observation, {}  # Return observation and an empty info dict
 
+    def validate_vision(self, observation):
+        assert self.observation_space['vision'].contains(observation['vision']), f"Vision data out of bounds: min={observation['vision'].min()}, max={observation['vision'].max()}"
+
+    def validate_step(self, observation):
+        """Full consistency checks of the knowledge graph and the observation, see helper_functions.should_validate."""
+        self.kg.verify_graph_integrity()
+        assert self.kg.check_entites_active(), "Discovered entities are inactive"
+        self.validate_vision(observation)
+
     def _calculate_reward(self):
         self.logger.info("Calculating reward...")
         agent_pos = (self.agent_controler.agent.grid_x, self.agent_controler.agent.grid_y)
@@ -168,8 +230,10 @@ class CustomEnv(gym.Env):
         reward += time_penalty
         
         # Check if agent reached a new outpost
-        if agent_pos in self.outpost_coords and agent_pos not in self.outposts_visited:
+        outpost = self.current_gm.target_manager.outpost_index.get(agent_pos)
+        if outpost is not None and not self.visited_mask >> outpost & 1:
             self.outposts_visited.add(agent_pos)
+            self.visited_mask |= 1 << outpost
             # print(f'New outpost at {agent_pos}, visited outposts: {len(self.outposts_visited)}, total outposts: {len(self.outpost_coords)}')
             outposts_visited = len(self.outposts_visited)
             # Increase reward for reaching outposts, with higher rewards for later outposts
@@ -183,6 +247,7 @@ class CustomEnv(gym.Env):
             if len(self.outposts_visited) == len(self.outpost_coords):
                 print(f"Agent reached all outposts. Outposts visited: {self.outposts_visited}")
                 self.outposts_visited.clear()
+                self.visited_mask = 0
                 assert len(self.outposts_visited) == 0, f"Outposts visited not cleared: {self.outposts_visited}"
                 completion_reward = self.completion_reward * (1 + 1 / self.episode_step)
                 print(f"Step: {self.agent_controler.agent_step_count}. All outposts visited. Completion reward: {completion_reward}")
@@ -221,10 +286,12 @@ class CustomEnv(gym.Env):
                 self.logger.info(f"Route Completed - Efficiency: {self.current_efficiency:.2f}, Improvement: {self.improvement:.2f}, Gap: {self.gap:.2f}")
 
             else:     
-                unvisited_outposts = set(self.outpost_coords) - self.outposts_visited
-                current_min_distance = min(manhattan_distance(agent_pos, outpost) for outpost in unvisited_outposts)
+                # Least energy to walk to the nearest unvisited outpost, over the terrain
+                current_min_distance = int(self.current_gm.target_manager.get_nearest_outpost_energy(self.visited_mask)[agent_pos])
                 
-                if current_min_distance < self.previous_min_distance:
+                if self.previous_min_distance == float('inf') or self.previous_min_distance == 0:
+                    pass  # Nothing to compare with yet
+                elif current_min_distance < self.previous_min_distance:
                     closer_reward = self.closer_to_outpost_reward * (self.previous_min_distance - current_min_distance) / self.previous_min_distance
                     reward += closer_reward
                     self.logger.info(f"Agent moved closer to an outpost. Reward: {closer_reward}")
@@ -289,7 +356,9 @@ class CustomEnv(gym.Env):
                     self.set_current_game_manager()
                     self.reset(False)
 
-        observation = self._get_observation()
+        observation = self._get_observation(copy=True if terminated or truncated else None)
+        if should_validate('full'):
+            self.validate_step(observation)
         info = {
             "episode_step": self.episode_step,
             "prev_position": prev_position,
@@ -314,9 +383,9 @@ class CustomEnv(gym.Env):
 
         # Check for no progress
         current_position = (self.agent_controler.agent.grid_x, self.agent_controler.agent.grid_y)
-        unvisited_outposts = set(self.outpost_coords) - self.outposts_visited
-        if unvisited_outposts:
-            current_min_distance = min(manhattan_distance(current_position, outpost) for outpost in unvisited_outposts)
+        if self.visited_mask != self.all_visited_mask:
+            nearest_outpost_energy = self.current_gm.target_manager.get_nearest_outpost_energy(self.visited_mask)
+            current_min_distance = int(nearest_outpost_energy[current_position])
             
             if current_min_distance < self.best_distance_to_unvisited:
                 self.best_distance_to_unvisited = current_min_distance
@@ -330,28 +399,89 @@ class CustomEnv(gym.Env):
 
         return False
 
-    def _get_observation(self):
+    def init_observation_buffers(self):
+        """
+        Observation arrays owned by the env and updated in place by _get_observation. Rows past the current
+        subgraph stay zero, a step only clears the rows that the previous, larger subgraph filled.
+        See write_graph for the graph rows that are written.
+        """
+        dtypes = {key: space.dtype for key, space in self.observation_space.spaces.items()}
+        if not self.compact:
+            # Graph arrays have always been float16 and int64, wider than their spaces declare
+            dtypes.update(node_features=np.float16, edge_attr=np.float16, edge_index=np.int64)
+        self.observation_buffers = {key: np.zeros(space.shape, dtype=dtypes[key]) for key, space in self.observation_space.spaces.items()}
+        if self.compact:
+            self.node_mask_bits = np.zeros(self.max_nodes, dtype=bool)
+            self.edge_mask_bits = np.zeros(self.max_edges, dtype=bool)
+        self.num_filled_nodes = 0
+        self.num_filled_edges = 0
+        self.last_graph = None  # Subgraph the graph buffers hold
+
+    @staticmethod
+    def write_rows(buffer, rows, num_filled):
+        """Write rows at the start of buffer and zero the rows left from a longer previous write."""
+        buffer[:len(rows)] = rows
+        buffer[len(rows):num_filled] = 0
+
+    def write_graph(self, graph):
+        """
+        Bring the graph buffers from last_graph to graph. Nothing is written when the knowledge graph returned
+        the same cached subgraph, only the changed node and edge rows when the subgraph kept its structure
+        (the same edge_index), and every row when it moved.
+        """
+        last_graph = self.last_graph
+        if graph is last_graph:
+            return
+        self.last_graph = graph
+        buffers = self.observation_buffers
+        x = graph.x.numpy()
+        edge_attr = graph.edge_attr.numpy()
+        if last_graph is not None and graph.edge_index is last_graph.edge_index and graph.num_nodes == last_graph.num_nodes:
+            node_rows = np.flatnonzero((x != last_graph.x.numpy()).any(axis=1))
+            edge_rows = np.flatnonzero((edge_attr != last_graph.edge_attr.numpy()).any(axis=1))
+            if self.compact:
+                self.node_mask_bits[node_rows] = x[node_rows, -1]
+                self.edge_mask_bits[edge_rows] = edge_attr[edge_rows, -1]
+                x, edge_attr = x[:, :-1], edge_attr[:, :-1]
+            buffers['node_features'][node_rows] = x[node_rows]
+            buffers['edge_attr'][edge_rows] = edge_attr[edge_rows]
+        else:
+            if self.compact:
+                self.write_rows(self.node_mask_bits, x[:, -1], self.num_filled_nodes)
+                self.write_rows(self.edge_mask_bits, edge_attr[:, -1], self.num_filled_edges)
+                x, edge_attr = x[:, :-1], edge_attr[:, :-1]
+            self.write_rows(buffers['node_features'], x, self.num_filled_nodes)
+            self.write_rows(buffers['edge_attr'], edge_attr, self.num_filled_edges)
+            self.write_rows(buffers['edge_index'].T, graph.edge_index.numpy().T, self.num_filled_edges)
+            self.num_filled_nodes, self.num_filled_edges = graph.num_nodes, graph.num_edges
+            if self.active_graph:
+                buffers['num_nodes'][0] = graph.num_nodes
+                buffers['num_edges'][0] = graph.num_edges
+        if self.compact:
+            # The mask columns are packed into bits
+            buffers['node_mask'][:] = np.packbits(self.node_mask_bits)
+            buffers['edge_mask'][:] = np.packbits(self.edge_mask_bits)
+
+    def _get_observation(self, copy=None):
+        """
+        Update the observation buffers and return them. With copy_observations (the default) the arrays
+        returned are copies. Without it they are the buffers themselves and only valid until the next step or
+        reset, unless copy is set: step copies observations that end an episode, which SB3's VecEnvs keep in
+        info['terminal_observation'] across the reset.
+        """
         self.logger.debug("Getting observation")
-        vision = self._get_vision()
-        graph: Data = self.current_gm.kg_class.get_subgraph()
-
-        # Ensure correct shapes
-        node_features = np.zeros((self.max_nodes, graph.num_node_features), dtype=np.float16)
-        node_features[:graph.num_nodes, :] = graph.x.numpy()
-
-        edge_attr = np.zeros((self.max_edges, graph.num_edge_features), dtype=np.float16)
-        edge_attr[:graph.num_edges, :] = graph.edge_attr.numpy()
-
-        edge_index = np.zeros((2, self.max_edges), dtype=np.int64)
-        edge_index[:, :graph.num_edges] = graph.edge_index.numpy()
+        if self.active_graph:
+            graph: Data = self.current_gm.kg_class.get_active_subgraph()
+        else:
+            graph: Data = self.current_gm.kg_class.get_subgraph()
+        buffers = self.observation_buffers
+        self.write_graph(graph)
+        self.write_vision(buffers['vision'])
 
         self.logger.debug("Observation retrieved")
-        return {
-            'vision': vision.astype(np.float16) / 255.0,  # Normalize to [0, 1]
-            'node_features': node_features,
-            'edge_attr': edge_attr,
-            'edge_index': edge_index
-        }
+        if self.copy_observations if copy is None else copy:
+            return {key: buffer.copy() for key, buffer in buffers.items()}
+        return dict(buffers)
 
     def get_clamped_surface(self):
         x = (self.agent_controler.agent.grid_x - self.vision_range) * self.current_gm.tile_size
@@ -361,11 +491,28 @@ class CustomEnv(gym.Env):
         surface_rect.clamp_ip(self.current_gm.renderer.surface.get_rect())
         return self.current_gm.renderer.surface.subsurface(surface_rect)
 
+    def get_vision_array(self):
+        """
+        The (3, W, H) uint8 pixels of the vision window, cropped from the display or drawn by the rasterizer
+        when headless. The rasterizer reuses its buffer.
+        """
+        if self.headless:
+            return self.current_gm.get_rasterizer().render()
+        return np.transpose(pygame.surfarray.array3d(self.get_clamped_surface()), (2, 0, 1))  # (W, H, C) to (C, W, H)
+
     def _get_vision(self):
-        vision_surface = self.get_clamped_surface()
-        vision_array = pygame.surfarray.array3d(vision_surface).astype(np.float16)
-        vision_array = np.transpose(vision_array, (2, 0, 1))  # Change from (H, W, C) to (C, H, W)
-        return vision_array
+        return self.get_vision_array().astype(np.float16)
+
+    def write_vision(self, out):
+        """Write the vision observation into out: symbolic ids, uint8 pixels when compact or else normalised float16 pixels."""
+        if self.vision_mode == 'symbolic':
+            self.current_gm.get_rasterizer().render_symbolic(out=out)
+        elif self.headless:
+            self.current_gm.get_rasterizer().render(normalised=not self.compact, out=out)
+        elif self.compact:
+            np.copyto(out, self.get_vision_array())
+        else:
+            np.copyto(out, self._get_vision() / 255.0)  # Normalize to [0, 1]
     
     def close(self):
         self.current_gm.end_game()
@@ -409,6 +556,7 @@ class CustomEnv(gym.Env):
             'target_route_energy': self.current_gm.target_manager.target_route_energy,
             'best_efficiency': self.best_efficiency,
             'improvement': self.improvement,
-            'gap': self.gap
+            'gap': self.gap,
+            'subgraph_cache_hit_rate': self.kg.subgraph_cache_hit_rate()
             }
     
\ No newline at end of file
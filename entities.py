@@ -3,27 +3,34 @@ import os
 
 class Entity(pygame.sprite.Sprite):
     _images = {}
+    id = None
+    art = None
 
-    def __init__(self, x, y, art, tile_size):
+    def __init__(self, x, y, tile_size, headless=False):
         super().__init__()
-        # Ensure the image is loaded
-        if art not in self._images:
-            full_path = f'Pixel_Art/{art}'
-            if os.path.exists(full_path):  
-                self._images[art] = pygame.transform.scale(pygame.image.load(full_path), (tile_size, tile_size))
-            else:
-                raise FileNotFoundError(f"Image file {art} not found in Pixel_Art directory.")
-        
-        self.image = self._images[art]
+        # Headless entities are only bookkeeping, they have no image to draw
+        self.image = None if headless else self.load_image(self.art, tile_size)
         self.grid_x = x
         self.grid_y = y
         self.tile_size = tile_size
         self.screen_x = x * tile_size
         self.screen_y = y * tile_size
-        self.rect = self.image.get_rect()
-        self.rect.x = self.screen_x
-        self.rect.y = self.screen_y
-        self.id = None
+        self.rect = None
+        if self.image is not None:
+            self.rect = self.image.get_rect()
+            self.rect.x = self.screen_x
+            self.rect.y = self.screen_y
+
+    @classmethod
+    def load_image(cls, art, tile_size):
+        # Ensure the image is loaded, once per art and tile size
+        if (art, tile_size) not in cls._images:
+            full_path = f'Pixel_Art/{art}'
+            if os.path.exists(full_path):
+                cls._images[(art, tile_size)] = pygame.transform.scale(pygame.image.load(full_path), (tile_size, tile_size))
+            else:
+                raise FileNotFoundError(f"Image file {art} not found in Pixel_Art directory.")
+        return cls._images[(art, tile_size)]
 
     def move(self, dx, dy):
         # Update the logical grid position
@@ -33,46 +40,40 @@ class Entity(pygame.sprite.Sprite):
         self.screen_x = self.grid_x * self.tile_size
         self.screen_y = self.grid_y * self.tile_size
         # Update the rect position for drawing and collision detection
-        self.rect.x = self.screen_x
-        self.rect.y = self.screen_y
+        if self.rect is not None:
+            self.rect.x = self.screen_x
+            self.rect.y = self.screen_y
 
 class Player(Entity):
-    def __init__(self, x, y, tile_size):
-        super().__init__(x, y, art='player.png', tile_size=tile_size)
-        self.id = 7
+    id = 7
+    art = 'player.png'
 
 class Outpost(Entity):
-    def __init__(self, x, y, tile_size):
-        super().__init__(x, y, art='outpost_2.png', tile_size=tile_size)
-        self.id = 5
+    id = 5
+    art = 'outpost_2.png'
 
 class WoodPath(Entity):
-    def __init__(self, x, y, tile_size):
-        super().__init__(x, y, art='wood_path.png', tile_size=tile_size)
-        self.id = 6
+    id = 6
+    art = 'wood_path.png'
 
 class Fish(Entity):
-    def __init__(self, x, y, tile_size):
-        super().__init__(x, y, art='fish.png', tile_size=tile_size)
-        self.id = 1
+    id = 1
+    art = 'fish.png'
 
 class Tree(Entity):
-    def __init__(self, x, y, tile_size):
-        super().__init__(x, y, art='tree_1.png', tile_size=tile_size)
-        self.id = 2
+    id = 2
+    art = 'tree_1.png'
 
 class Rock(Entity):
-    def __init__(self, x, y, art, tile_size):
-        super().__init__(x, y, art, tile_size)
+    pass
 
 class MossyRock(Rock):
-    def __init__(self, x, y, tile_size):
-        super().__init__(x, y, art='rock_moss.png', tile_size=tile_size)
-        self.id = 3
+    id = 3
+    art = 'rock_moss.png'
 
 class SnowyRock(Rock):
-    def __init__(self, x, y, tile_size):
-        super().__init__(x, y, art='rock_snow.png', tile_size=tile_size)
-        self.id = 4
-
+    id = 4
+    art = 'rock_snow.png'
 
+# Entity class of each id in the entity index grid
+ENTITY_CLASSES = {entity_class.id: entity_class for entity_class in (Fish, Tree, MossyRock, SnowyRock, Outpost, WoodPath, Player)}
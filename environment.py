@@ -2,22 +2,30 @@ import random
 import pygame
 import numpy as np
 
-from entities import Player, Outpost, WoodPath, Tree, MossyRock, SnowyRock
+from entities import Player, Outpost, WoodPath, Fish, Tree, MossyRock, SnowyRock, ENTITY_CLASSES
 from terrains import Terrain, DeepWater, Water, Plains, Hills, Mountains, Snow
 
 class Environment:
-    def __init__(self, heightmap: np.ndarray, tile_size: int = 50, number_of_outposts: int = 3):
+    def __init__(self, heightmap: np.ndarray, tile_size: int = 50, number_of_outposts: int = 3, headless: bool = False,
+                 world_state=None):
         self.heightmap = heightmap
+        # A headless world has no images and no sprite group, it is never drawn
+        self.headless = headless
         self.terrain_index_grid = np.zeros_like(self.heightmap)
         self.entity_index_grid = np.zeros_like(self.heightmap)
         self.terrain_object_grid = np.zeros_like(self.heightmap, dtype=object)
+        # World state, the terrain objects are a facade over these arrays
+        self.passable = np.ones(self.heightmap.shape, dtype=bool)
+        self.energy_requirement = np.zeros(self.heightmap.shape, dtype=np.int16)
+        self.elevation = np.zeros(self.heightmap.shape, dtype=np.int8)
+        self.entity_id = self.entity_index_grid
         
         self.tile_size = tile_size
         self.width, self.height = heightmap.shape
         self.number_of_outposts = number_of_outposts
         self.outpost_locations = [] # List of (x, y) coordinates for each outpost, no need to use an array here
 
-        self.entity_group = pygame.sprite.LayeredUpdates() # pygame.sprite.Group()
+        self.entity_group = None if headless else pygame.sprite.LayeredUpdates() # pygame.sprite.Group()
         self.terrain_definitions = {
             0: {'class': DeepWater, 'entity_prob': 0},
             1: {'class': Water, 'entity_prob': 0},
@@ -30,16 +38,67 @@ class Environment:
         self.suitable_terrain_locations = {'Plains': [], 'Hills': [], 'Mountains': [], 'Snow': []}
         self.less_suitable_terrain_locations = {'Plains': [], 'Hills': [], 'Mountains': [], 'Snow': []}
 
-        self.initialize_environment()
-        self.add_outposts()
+        # Snapshot state, see take_snapshot
+        self.snapshot = None
+        self.saved_tiles = {}
+        self.energy_changed_tiles = set()  # Tiles whose energy requirement changed since the snapshot
+        self.added_sprites = []
+        self.removed_sprites = []
+        # Called with the tiles whose energy requirement changed, see add_energy_listener
+        self.energy_listeners = []
 
-        self.player = self.init_player()
+        # A world generated elsewhere (see get_world_state) is built over its state, nothing is placed again
+        if world_state is None:
+            self.initialize_environment()
+            self.add_outposts()
+            self.player = self.init_player()
+        else:
+            self.player = self.load_world_state(world_state)
 
         self.environment_changed_flag = False
         self.changed_tiles_list = []
 
         # print(f"entity index grid{self.entity_index_grid}")
 
+    def get_world_state(self):
+        """
+        The state of a newly generated world that Environment(heightmap, ..., world_state=...) is built from:
+        the entity ids and state arrays, the outposts, the player position and the outpost candidate tiles.
+        """
+        return (self.entity_index_grid, self.passable, self.energy_requirement, self.elevation, self.outpost_locations,
+                (self.player.grid_x, self.player.grid_y), self.suitable_terrain_locations,
+                self.less_suitable_terrain_locations)
+
+    def load_world_state(self, world_state):
+        """Build the terrain, entity and player objects over the state of a generated world and return the player."""
+        (entity_ids, passable, energy_requirement, elevation, outpost_locations, (player_x, player_y),
+         self.suitable_terrain_locations, self.less_suitable_terrain_locations) = world_state
+        np.copyto(self.terrain_index_grid, self.heightmap)
+        for array, state in ((self.entity_index_grid, entity_ids), (self.passable, passable),
+                             (self.energy_requirement, energy_requirement), (self.elevation, elevation)):
+            np.copyto(array, state)
+        xs, ys = np.indices(self.heightmap.shape)
+        for x, y, terrain_code, elevation_level in zip(xs.ravel().tolist(), ys.ravel().tolist(),
+                                                      self.heightmap.ravel().tolist(), elevation.ravel().tolist()):
+            terrain_info = self.terrain_definitions[terrain_code]
+            self.terrain_object_grid[x, y] = terrain_info['class'].from_world(x, y, self.tile_size, terrain_info['entity_prob'],
+                                                                             self, elevation_level)
+        resource_ids = [entity_class.id for entity_class in (Fish, Tree, MossyRock, SnowyRock)]
+        for x, y in np.argwhere(np.isin(entity_ids, resource_ids)).tolist():
+            self.place_loaded_entity(ENTITY_CLASSES[int(entity_ids[x, y])](x, y, self.tile_size, self.headless))
+        for x, y in outpost_locations:
+            self.place_loaded_entity(Outpost(x, y, self.tile_size, self.headless))
+            self.outpost_locations.append((x, y))
+        player = Player(player_x, player_y, self.tile_size, self.headless)
+        self.add_sprite(player, layer=2)
+        return player
+
+    def place_loaded_entity(self, entity):
+        terrain = self.terrain_object_grid[entity.grid_x, entity.grid_y]
+        terrain.entity_on_tile = entity
+        terrain.entity_index = entity.id
+        self.add_sprite(entity)
+
     def get_random_zero_coordinate(self):
         zero_coords = np.argwhere(self.entity_index_grid == 0)
         if zero_coords.size == 0:
@@ -59,10 +118,9 @@ class Environment:
         return random.choice(self.less_suitable_terrain_locations[key])
 
     def get_terrain_colour_map(self):
-        terrain = Terrain(0, 0, self.tile_size, 0)
         map = {}
         for terrain_code, value in self.terrain_definitions.items():
-            map[terrain_code] = terrain.set_colour(terrain_code)
+            map[terrain_code] = Terrain.set_colour(terrain_code)
         return map
 
     def initialize_environment(self):
@@ -73,7 +131,7 @@ class Environment:
                 terrain_class = terrain_info['class']
                 entity_prob = terrain_info['entity_prob']
                 # Instantiate the terrain with its corresponding properties
-                self.terrain_object_grid[x, y] = terrain_class(x, y, self.tile_size, entity_prob)
+                self.terrain_object_grid[x, y] = terrain_class(x, y, self.tile_size, entity_prob, self)
                 # Add entity to terrain if entity_prob is met
                 self.init_entity(self.terrain_object_grid[x, y], x, y)
 
@@ -83,8 +141,8 @@ class Environment:
     def init_entity(self, terrain, x, y):
         if random.random() < terrain.entity_prob:
             entity_type = terrain.entity_type
-            entity = entity_type(x, y, self.tile_size)
-            self.entity_group.add(entity)
+            entity = entity_type(x, y, self.tile_size, self.headless)
+            self.add_sprite(entity)
             self.entity_index_grid[x, y] = entity.id
             self.terrain_object_grid[x, y].add_entity(entity)
             
@@ -113,8 +171,8 @@ class Environment:
         selected_locations = random.sample(possible_locations, min(len(possible_locations), self.number_of_outposts))
 
         for x, y in selected_locations:
-            outpost = Outpost(x, y, self.tile_size)
-            self.entity_group.add(outpost)
+            outpost = Outpost(x, y, self.tile_size, self.headless)
+            self.add_sprite(outpost)
             self.terrain_object_grid[x, y].add_entity(outpost)
             self.terrain_object_grid[x, y].passable = True
             self.terrain_object_grid[x, y].energy_requirement = 0
@@ -151,12 +209,73 @@ class Environment:
         else:
             location = self.get_random_zero_coordinate()
             self.terrain_object_grid[location[0], location[1]].remove_entity()
-        player = Player(location[0], location[1], self.tile_size)
-        self.entity_group.add(player, layer=2)
+        player = Player(location[0], location[1], self.tile_size, self.headless)
+        self.add_sprite(player, layer=2)
         # Cannot use the entity_index_grid to store the player id, as it is already used to store the woodpath id
         self.entity_index_grid[location[0], location[1]] = player.id
         return player
     
+    def add_sprite(self, entity, layer=0):
+        if self.entity_group is not None:
+            self.entity_group.add(entity, layer=layer)
+
+    def take_snapshot(self):
+        """
+        Record the current world so that restore_snapshot can bring it back. The state arrays are copied,
+        terrain tiles are copied on write: a tile's state is saved the first time it changes afterwards.
+        """
+        player_pos = (self.player.grid_x, self.player.grid_y)
+        arrays = (self.terrain_index_grid, self.entity_index_grid, self.passable, self.energy_requirement, self.elevation)
+        self.snapshot = (tuple(array.copy() for array in arrays), player_pos)
+        self.saved_tiles = {}
+        self.energy_changed_tiles = set()
+        self.added_sprites = []
+        self.removed_sprites = []
+
+    def add_energy_listener(self, listener):
+        """listener(changes) is called with a list of (x, y, old_energy, new_energy) whenever tile energies change."""
+        self.energy_listeners.append(listener)
+
+    def set_energy_requirement(self, x, y, value):
+        old_value = int(self.energy_requirement[x, y])
+        self.energy_requirement[x, y] = value
+        if value != old_value:
+            if self.snapshot is not None:
+                self.energy_changed_tiles.add((x, y))
+            for listener in self.energy_listeners:
+                listener([(x, y, old_value, value)])
+
+    def save_tile(self, x, y):
+        if self.snapshot is not None and (x, y) not in self.saved_tiles:
+            self.saved_tiles[(x, y)] = self.terrain_object_grid[x, y].save_state()
+
+    def restore_snapshot(self):
+        """Bring the world back to the last snapshot, only the tiles changed since are touched."""
+        saved_arrays, (player_x, player_y) = self.snapshot
+        saved_energy = saved_arrays[3]
+        energy_changes = [(x, y, int(self.energy_requirement[x, y]), int(saved_energy[x, y]))
+                          for x, y in self.energy_changed_tiles if saved_energy[x, y] != self.energy_requirement[x, y]]
+        self.energy_changed_tiles.clear()
+        # In place, the knowledge graph, agent, target manager and terrain tiles share these arrays
+        arrays = (self.terrain_index_grid, self.entity_index_grid, self.passable, self.energy_requirement, self.elevation)
+        for array, saved in zip(arrays, saved_arrays):
+            np.copyto(array, saved)
+        for (x, y), state in self.saved_tiles.items():
+            self.terrain_object_grid[x, y].load_state(state)
+        self.saved_tiles.clear()
+        for sprite in self.added_sprites:
+            self.entity_group.remove(sprite)
+        for sprite, layer in self.removed_sprites:
+            self.add_sprite(sprite, layer=layer)
+        self.added_sprites.clear()
+        self.removed_sprites.clear()
+        self.player.move(player_x - self.player.grid_x, player_y - self.player.grid_y)
+        self.changed_tiles_list.clear()
+        self.environment_changed_flag = False
+        if energy_changes:
+            for listener in self.energy_listeners:
+                listener(energy_changes)
+
     def update_terrain_passability(self, x, y, entity):
         terrain = self.terrain_object_grid[x, y]
         if isinstance(entity, WoodPath):
@@ -169,6 +288,8 @@ class Environment:
         if not self.is_move_valid(new_x, new_y):
             return current_x, current_y
 
+        self.save_tile(current_x, current_y)
+        self.save_tile(new_x, new_y)
         self.terrain_object_grid[current_x, current_y].remove_entity()
         entity.move(dx, dy)
         self.terrain_object_grid[new_x, new_y].add_entity(entity)
@@ -178,13 +299,20 @@ class Environment:
     
     def delete_entity(self, entity):
         x, y = entity.grid_x, entity.grid_y
+        self.save_tile(x, y)
+        if self.entity_group is not None:
+            if self.snapshot is not None:
+                if entity in self.added_sprites:
+                    self.added_sprites.remove(entity)
+                else:
+                    self.removed_sprites.append((entity, self.entity_group.get_layer_of_sprite(entity)))
+            self.entity_group.remove(entity)
         self.terrain_object_grid[x, y].remove_entity()
-        self.entity_group.remove(entity)
         self.entity_index_grid[x, y] = 0
         self.single_environment_changed(x, y)
 
     def is_move_valid(self, x: int, y: int) -> bool:
-        return self.within_bounds(x, y) and self.terrain_object_grid[x, y].passable
+        return self.within_bounds(x, y) and bool(self.passable[x, y])
 
     def within_bounds(self, x, y):
         return 0 <= x < self.width and 0 <= y < self.height
@@ -199,13 +327,17 @@ class Environment:
         self.changed_tiles_list.append((x, y))
 
     def place_path(self, x, y):
-        wood_path = WoodPath(x, y, self.tile_size)
-        self.entity_group.add(wood_path)
+        wood_path = WoodPath(x, y, self.tile_size, self.headless)
+        self.save_tile(x, y)
+        if self.snapshot is not None and self.entity_group is not None:
+            self.added_sprites.append(wood_path)
+        self.add_sprite(wood_path)
         self.entity_index_grid[x, y] = wood_path.id
         self.terrain_object_grid[x, y].add_path(wood_path)
         self.single_environment_changed(x, y)
 
     def drop_rock_in_water(self, x, y, fill_type):
+        self.save_tile(x, y)
         if fill_type == 0:
             self.terrain_object_grid[x, y].shallow()
         elif fill_type == 1:
@@ -239,7 +371,12 @@ class Environment:
         number_of_wood_paths = 0
         number_of_players = 0
 
-        for entity in self.entity_group:
+        if self.entity_group is not None:
+            entities = list(self.entity_group)
+        else:
+            entities = [tile.entity_on_tile for tile in self.terrain_object_grid.flat if tile.entity_on_tile is not None]
+            entities += [] if self.player in entities else [self.player]
+        for entity in entities:
             if isinstance(entity, Player):
                 number_of_players += 1
             elif isinstance(entity, Outpost):
@@ -5,13 +5,26 @@ import random
 from heightmap_generator import HeightmapGenerator
 from environment import Environment
 from agent import Agent
-from renderer import Renderer
+from renderer import Renderer, Vision_Rasterizer
 from target import Target_Manager
 
 from knowledge_graph import KnowledgeGraph
 
+def generate_world_spec(num_tiles, tile_size, number_of_outposts, world_seed):
+    """
+    Generate a world from its seed and return what a GameManager needs to build it without generating or planning
+    anything: (heightmap, Environment world state, Target_Manager route state). Only depends on its arguments, so
+    worlds can be generated in any process and in any order.
+    """
+    random.seed(world_seed)
+    heightmap = GameManager.generate_heightmap(num_tiles)
+    environment = Environment(heightmap, tile_size, number_of_outposts=number_of_outposts, headless=True)
+    route_state = Target_Manager(environment).get_route_state()
+    return heightmap, environment.get_world_state(), route_state
+
 class GameManager:
-    def __init__(self, num_tiles=32, screen_size=800, vision_range=2, plot=False):
+    def __init__(self, num_tiles=32, screen_size=800, vision_range=2, plot=False, subgraph_mode='khop', compact=False, headless=False,
+                 number_of_outposts=3, world_spec=None):
         self.num_tiles = num_tiles
         self.tile_size: int = screen_size // num_tiles
         self.environment = None
@@ -21,8 +34,17 @@ class GameManager:
         self.route_energy_list = []
         self.vision_range = vision_range
         self.renderer = None
+        self.rasterizer = None
         self.running = True
         self.plot = plot
+        self.subgraph_mode = subgraph_mode
+        self.compact = compact
+        # Headless games never initialise pygame or load images, vision comes from get_rasterizer
+        self.headless = headless
+        self.number_of_outposts = number_of_outposts  # Stops of the trade route, see Target_Manager for the planning
+        self.kg_class = None
+        self.kg_snapshot = None  # Knowledge graph at the start of the first game
+        self.world_spec = world_spec  # From generate_world_spec, the world is built from it instead of generated
 
         self.initialize_components()
 
@@ -30,25 +52,33 @@ class GameManager:
         pygame.init()
         pygame.display.set_caption("Game World")
 
-    def initialize_components(self):
-        # Generate heightmap
+    @staticmethod
+    def generate_heightmap(num_tiles):
         heightmap_generator = HeightmapGenerator(
-            width=self.num_tiles, 
-            height=self.num_tiles, 
+            width=num_tiles, 
+            height=num_tiles, 
             scale=10, 
             terrain_thresholds=np.array([0.1, 0.2, 0.5, 0.7, 0.9, 1.0]), 
             octaves=3, persistence=0.2, lacunarity=2.0
         )
-        heightmap = heightmap_generator.generate()
-        self.environment = Environment(heightmap, self.tile_size, number_of_outposts=3)
+        return heightmap_generator.generate()
+
+    def initialize_components(self):
+        if self.world_spec is None:
+            heightmap, world_state, route_state = self.generate_heightmap(self.num_tiles), None, None
+        else:
+            heightmap, world_state, route_state = self.world_spec
+        self.environment = Environment(heightmap, self.tile_size, number_of_outposts=self.number_of_outposts, headless=self.headless,
+                                       world_state=world_state)
 
         self.agent_controler = Agent(self.environment, self.vision_range)
         self.agent = self.agent_controler.agent
         
-        self.target_manager = Target_Manager(self.environment)
+        self.target_manager = Target_Manager(self.environment, route_state=route_state)
 
     def init_knowledge_graph(self, kg_completeness):
-        self.kg_class = KnowledgeGraph(self.environment, self.vision_range, kg_completeness, self.plot)
+        self.kg_class = KnowledgeGraph(self.environment, self.vision_range, kg_completeness, self.plot,
+                                       subgraph_mode=self.subgraph_mode, compact=self.compact)
         self.agent_controler.get_kg(self.kg_class)
 
     def initialise_rendering(self):
@@ -56,19 +86,46 @@ class GameManager:
         self.screen = pygame.display.set_mode((self.num_tiles * self.tile_size, self.num_tiles * self.tile_size))
         self.renderer.init_render()
 
+    def get_rasterizer(self):
+        if self.rasterizer is None:
+            self.rasterizer = Vision_Rasterizer(self.environment, self.vision_range)
+        return self.rasterizer
+
     def rerender(self):
+        if self.headless:
+            return
         self.renderer.render_updated_tiles()
         # self.renderer.render_heatmap(self.target_manager.min_path_length, bool_heatmap=True)
         pygame.display.flip()
 
     def start_game(self, kg_completeness=0.5):
+        if self.headless:
+            self.reset_world(kg_completeness)
+            return
         self.init_pygame()
-        self.init_knowledge_graph(kg_completeness)
+        self.reset_world(kg_completeness)
         self.initialise_rendering()
 
+    def reset_world(self, kg_completeness):
+        """
+        Bring the world and knowledge graph back to their state at the start of the first game, so every game
+        in this world starts the same. The first call builds the knowledge graph and takes the snapshots,
+        later calls restore them and apply the completeness as a mask over the restored graph.
+        """
+        if self.kg_snapshot is None:
+            self.init_knowledge_graph(kg_completeness)
+            self.kg_snapshot = self.kg_class.take_snapshot()
+            # Taken after the knowledge graph, which removes the player from the entity grid
+            self.environment.take_snapshot()
+        else:
+            self.environment.restore_snapshot()
+            self.kg_class.restore_snapshot(self.kg_snapshot)
+            self.kg_class.set_completeness(kg_completeness)
+
     def end_game(self):
         self.running = False
-        pygame.quit()
+        if not self.headless:
+            pygame.quit()
 
 
     #####################################################################################
@@ -1,3 +1,21 @@
+import numpy as np
+import torch
+from collections import OrderedDict
+from torch_geometric.utils import k_hop_subgraph
+
+
+def build_incidence_index(edge_nodes, num_edges, num_nodes):
+    """Return the CSR (ptr, edges) index of the edges incident to every node of an edge list."""
+    sources, targets = edge_nodes[:, :num_edges]
+    # Every directed edge is incident to both its source and its target node
+    nodes = np.concatenate((sources, targets))
+    edges = np.concatenate((np.arange(num_edges), np.arange(num_edges)))
+    order = np.argsort(nodes, kind='stable')
+    ptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(nodes, minlength=num_nodes), out=ptr[1:])
+    return ptr, edges[order]
+
+
 class Graph_Manager:
     def __init__(self):
         self.player_idx = None
@@ -6,6 +24,10 @@ class Graph_Manager:
         self.nodeId_idx_dict = {}
         self.current_edge_idx = 0
         self.nodeTuples_edgeIdx_dict = {}  # Maps edge tuples to indices
+        self.edge_nodes = None  # (2, max_edges) array of the (source, target) node of every edge index
+        self.edge_nodes_tensor = None  # Long tensor sharing the memory of edge_nodes
+        self.incidence_ptr = None  # CSR row pointers, edges of node n are incidence_edges[ptr[n]:ptr[n + 1]]
+        self.incidence_edges = None
 
     def create_idx(self, pos, z_level):
         node_idx = self.node_idx
@@ -41,6 +63,33 @@ class Graph_Manager:
         #     return
         self.nodeTuples_edgeIdx_dict[(node_idx1, node_idx2)] = direct_edge_idx
         self.nodeTuples_edgeIdx_dict[(node_idx2, node_idx1)] = reverse_edge_idx 
+        self.edge_nodes[:, direct_edge_idx] = (node_idx1, node_idx2)
+        self.edge_nodes[:, reverse_edge_idx] = (node_idx2, node_idx1)
+        self.incidence_ptr = None  # The incidence index is stale until it is rebuilt
+
+    def build_incidence_index(self):
+        """
+        Build a CSR index of the edges incident to every node, so that the lookups below
+        cost O(degree) instead of a scan over every stored edge.
+        """
+        if self.incidence_ptr is not None:
+            return
+        self.incidence_ptr, self.incidence_edges = build_incidence_index(self.edge_nodes, self.current_edge_idx, self.max_nodes)
+
+    def get_incident_edges(self, node_idx):
+        """Return an array of the indices of all edges that start or end at the node."""
+        if self.incidence_ptr is None:
+            self.build_incidence_index()
+        return self.incidence_edges[self.incidence_ptr[node_idx]:self.incidence_ptr[node_idx + 1]]
+
+    def get_incident_edges_of_nodes(self, node_indices):
+        """Return the concatenated incident edge indices of an array of nodes."""
+        if self.incidence_ptr is None:
+            self.build_incidence_index()
+        starts = self.incidence_ptr[node_indices]
+        counts = self.incidence_ptr[node_indices + 1] - starts
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return self.incidence_edges[positions]
 
     def retrieve_edge_indices(self, node_idx1, node_idx2):
         """Retrieve indices for both directions of the edge."""
@@ -50,17 +99,273 @@ class Graph_Manager:
     
     def retrieve_edge_node_pairs_from_node(self, node_idx):
         """Retrieve all node pairs that the node is included in."""
-        node_pairs = [edge for edge in self.nodeTuples_edgeIdx_dict if node_idx in edge]
-        return node_pairs
+        edge_indices = self.get_incident_edges(node_idx)
+        sources, targets = self.edge_nodes[:, edge_indices]
+        return list(zip(sources.tolist(), targets.tolist()))
     
     def retrieve_edge_indicies_from_node(self, node_idx):
         """Retrieve all edges from a node, including both incoming and outgoing edges."""
-        node_pairs = self.retrieve_edge_node_pairs_from_node(node_idx)
-        edge_indices = [self.nodeTuples_edgeIdx_dict.get(pair) for pair in node_pairs]
-        return edge_indices
+        return self.get_incident_edges(node_idx).tolist()
     
+    def get_tile_tensors(self, width, height):
+        """
+        Return the x and y coordinate, the terrain and entity node indices and the entity->player edge index
+        of every tile, as flat tensors in (x, y) order.
+        """
+        xs, ys = np.meshgrid(np.arange(width), np.arange(height), indexing='ij')
+        tiles = list(zip(xs.ravel().tolist(), ys.ravel().tolist()))
+        terrain_nodes = [self.get_node_idx(tile, 0) for tile in tiles]
+        entity_nodes = [self.get_node_idx(tile, 1) for tile in tiles]
+        player_edges = [self.retrieve_edge_indices(node_idx, self.player_idx)[0] for node_idx in entity_nodes]
+        return (torch.from_numpy(xs.ravel()), torch.from_numpy(ys.ravel()), torch.tensor(terrain_nodes),
+                torch.tensor(entity_nodes), torch.tensor(player_edges))
+
+    def get_khop(self, node_idx, num_hops, edge_index):
+        """Return the (subset, edge_index, edge_mask) of the k-hop subgraph around a node, edge_index relabelled to positions in the subset."""
+        subset, sub_edge_index, mapping, edge_mask = k_hop_subgraph(node_idx=node_idx, num_hops=num_hops, edge_index=edge_index)
+        # The subset is sorted, relabel here as k_hop_subgraph's relabel_nodes needs int64 edges
+        sub_edge_index = torch.searchsorted(subset, sub_edge_index.long()).to(sub_edge_index.dtype)
+        return subset, sub_edge_index, edge_mask
+
     def set_max_nodes(self, n):
         self.max_nodes = n
 
     def set_max_edges(self, n):
-        self.max_edges = n
\ No newline at end of file
+        self.max_edges = n
+        self.edge_nodes = np.full((2, n), -1, dtype=np.int64)
+        self.edge_nodes_tensor = torch.from_numpy(self.edge_nodes)
+
+
+class Grid_Topology:
+    """
+    The node and edge layout of the grid knowledge graph for one map size.
+
+    The KG always has the same layout: the player node first, then a terrain and an entity node
+    for every tile in row-major (y, x) order, followed by the 4-neighbour terrain edges and the
+    entity->terrain and entity->player edges. Every world of the same size therefore shares one
+    read-only topology: edge lookup tables, edge_index, the incidence index and the cached
+    observation subgraph structures. Use get_grid_topology rather than building one directly.
+
+    Torch has no read-only tensors, so edge_index, edge_nodes_tensor and the tensors of the cached
+    structures must never be written in place, check_edge_index asserts this when the KG is validated.
+    """
+    player_idx = 0
+    cache_size = 256
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.max_nodes = width * height * 2 + 1
+        self.build_edge_tables()
+        self.incidence_ptr, self.incidence_edges = build_incidence_index(self.edge_nodes, self.max_edges, self.max_nodes)
+        self.edge_index = torch.from_numpy(self.edge_nodes.astype(np.int32))
+        self.edge_nodes_tensor = torch.from_numpy(self.edge_nodes)  # Made before edge_nodes is read-only, torch warns otherwise
+
+        xs, ys = np.meshgrid(np.arange(width), np.arange(height), indexing='ij')
+        terrain_nodes = self.terrain_idx_grid(xs, ys).ravel()
+        self.tile_tensors = (torch.from_numpy(xs.ravel()), torch.from_numpy(ys.ravel()),
+                             torch.from_numpy(terrain_nodes), torch.from_numpy(terrain_nodes + 1),
+                             torch.from_numpy(self.entity_player_edge.ravel().copy()))
+
+        for array in (self.right_edge, self.down_edge, self.entity_terrain_edge, self.entity_player_edge,
+                      self.edge_nodes, self.incidence_ptr, self.incidence_edges):
+            array.setflags(write=False)
+        self.window_cache = OrderedDict()  # (center, radius, metric) -> window tables, least recently used first
+        self.khop_cache = OrderedDict()  # (node_idx, num_hops) -> k-hop subgraph structure
+
+    def build_edge_tables(self):
+        """Reproduce the edge ordering of KnowledgeGraph.create_terrain_edges and add_entity_edges."""
+        width, height = self.width, self.height
+        xs, ys = np.meshgrid(np.arange(width), np.arange(height), indexing='ij')
+        has_right = xs < width - 1
+        has_down = ys < height - 1
+        # Terrain edges are created looping over x, then y, each edge taking a direct and a reverse index
+        edges_per_tile = 2 * (has_right.astype(np.int64) + has_down)
+        offsets = (np.cumsum(edges_per_tile) - edges_per_tile.ravel()).reshape(width, height)
+        self.right_edge = np.where(has_right, offsets, -1)
+        self.down_edge = np.where(has_down, offsets + 2 * has_right, -1)
+        # Entity edges follow the terrain edges, four per tile (terrain and player, both directions)
+        num_terrain_edges = int(edges_per_tile.sum())
+        entity_offsets = num_terrain_edges + 4 * (xs * height + ys)
+        self.entity_terrain_edge = entity_offsets
+        self.entity_player_edge = entity_offsets + 2
+        self.max_edges = num_terrain_edges + 4 * width * height
+
+        terrain_nodes = self.terrain_idx_grid(xs, ys)
+        entity_nodes = terrain_nodes + 1
+        self.edge_nodes = np.empty((2, self.max_edges), dtype=np.int64)
+        self.fill_edge_nodes(self.right_edge[has_right], terrain_nodes[has_right], terrain_nodes[1:, :].ravel())
+        self.fill_edge_nodes(self.down_edge[has_down], terrain_nodes[has_down], terrain_nodes[:, 1:].ravel())
+        self.fill_edge_nodes(self.entity_terrain_edge.ravel(), entity_nodes.ravel(), terrain_nodes.ravel())
+        self.fill_edge_nodes(self.entity_player_edge.ravel(), entity_nodes.ravel(), self.player_idx)
+
+    def fill_edge_nodes(self, direct_edges, sources, targets):
+        self.edge_nodes[0, direct_edges] = sources
+        self.edge_nodes[1, direct_edges] = targets
+        self.edge_nodes[0, direct_edges + 1] = targets
+        self.edge_nodes[1, direct_edges + 1] = sources
+
+    def terrain_idx_grid(self, x, y):
+        return 1 + 2 * (y * self.width + x)
+
+    def check_edge_index(self):
+        assert np.array_equal(self.edge_index.numpy(), self.edge_nodes), "Shared grid edge_index was written in place"
+
+    def cached(self, cache, key, build):
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        value = build()
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return value
+
+    def get_khop(self, node_idx, num_hops):
+        """Return the (subset, edge_index, edge_mask) of the k-hop subgraph around a node, edge_index relabelled to positions in the subset."""
+        def build():
+            subset, edge_index, mapping, edge_mask = k_hop_subgraph(node_idx=node_idx, num_hops=num_hops, edge_index=self.edge_index)
+            # The subset is sorted, relabel here as k_hop_subgraph's relabel_nodes needs int64 edges
+            edge_index = torch.searchsorted(subset, edge_index.long()).to(edge_index.dtype)
+            return subset, edge_index, edge_mask
+        return self.cached(self.khop_cache, (node_idx, num_hops), build)
+
+    def get_window(self, center, radius, metric='box'):
+        """
+        Return the (subset, edge_ids, edge_index) tables of the subgraph spanned by the tiles around center.
+        'box' keeps tiles within a Chebyshev radius, 'manhattan' within a Manhattan radius. The subset holds the
+        sorted node indices (player node included), edge_ids the sorted edge indices between them and edge_index
+        those edges relabelled to positions in the subset.
+        """
+        return self.cached(self.window_cache, (tuple(center), radius, metric), lambda: self.build_window(center, radius, metric))
+
+    def build_window(self, center, radius, metric):
+        cx, cy = center
+        x0, x1 = max(cx - radius, 0), min(cx + radius, self.width - 1)
+        y0, y1 = max(cy - radius, 0), min(cy + radius, self.height - 1)
+        xs, ys = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1), indexing='ij')
+        if metric == 'box':
+            inside = np.ones(xs.shape, dtype=bool)
+        elif metric == 'manhattan':
+            inside = np.abs(xs - cx) + np.abs(ys - cy) <= radius
+        else:
+            raise ValueError(f"Invalid window metric: {metric}")
+
+        terrain_nodes = self.terrain_idx_grid(xs[inside], ys[inside])
+        subset = np.sort(np.concatenate(([self.player_idx], terrain_nodes, terrain_nodes + 1)))
+        right = inside[:-1, :] & inside[1:, :]
+        down = inside[:, :-1] & inside[:, 1:]
+        direct_edges = np.concatenate((
+            self.right_edge[x0:x1, y0:y1 + 1][right],
+            self.down_edge[x0:x1 + 1, y0:y1][down],
+            self.entity_terrain_edge[x0:x1 + 1, y0:y1 + 1][inside],
+            self.entity_player_edge[x0:x1 + 1, y0:y1 + 1][inside],
+        ))
+        edge_ids = np.sort(np.concatenate((direct_edges, direct_edges + 1)))
+        edge_index = np.searchsorted(subset, self.edge_nodes[:, edge_ids])
+        return subset, edge_ids, edge_index
+
+
+_grid_topologies = {}
+
+def get_grid_topology(width, height):
+    """Return the shared topology for maps of this size, building it on first use."""
+    key = (width, height)
+    if key not in _grid_topologies:
+        _grid_topologies[key] = Grid_Topology(width, height)
+    return _grid_topologies[key]
+
+
+class Grid_Graph_Manager(Graph_Manager):
+    """
+    Closed-form indexing for the regular grid knowledge graph.
+
+    Node indices are computed arithmetically and edge indices are read from the lookup tables of the
+    Grid_Topology shared by every world of the same size, so no per-node or per-edge dictionaries
+    are stored and a world only owns the position of its player.
+    """
+    def __init__(self, width, height):
+        super().__init__()
+        self.topology = get_grid_topology(width, height)
+        self.width = width
+        self.height = height
+        self.player_idx = self.topology.player_idx
+        self.player_pos = None
+        self.max_nodes = self.topology.max_nodes
+        self.max_edges = self.current_edge_idx = self.topology.max_edges
+        self.edge_nodes = self.topology.edge_nodes
+        self.edge_nodes_tensor = self.topology.edge_nodes_tensor
+        self.incidence_ptr = self.topology.incidence_ptr
+        self.incidence_edges = self.topology.incidence_edges
+        self.right_edge = self.topology.right_edge
+        self.down_edge = self.topology.down_edge
+        self.entity_terrain_edge = self.topology.entity_terrain_edge
+        self.entity_player_edge = self.topology.entity_player_edge
+
+    def terrain_idx_grid(self, x, y):
+        return self.topology.terrain_idx_grid(x, y)
+
+    def within_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def create_idx(self, pos, z_level):
+        if z_level == 2:
+            self.player_pos = pos
+        return self.get_node_idx(pos, z_level)
+
+    def get_node_idx(self, pos, z_level):
+        if z_level == 2:
+            return self.player_idx
+        x, y = pos
+        if not self.within_bounds(x, y) or z_level not in (0, 1):
+            return None
+        return int(self.terrain_idx_grid(x, y)) + z_level
+
+    def get_node_id(self, node_idx):
+        """Return the ((x, y), z_level) identifier of a node, the inverse of get_node_idx."""
+        if node_idx == self.player_idx:
+            return self.player_pos, 2
+        cell, z_level = divmod(node_idx - 1, 2)
+        y, x = divmod(cell, self.width)
+        return (x, y), z_level
+
+    def get_node_pos(self, node_idx):
+        return self.get_node_id(node_idx)[0]
+
+    def create_edge_idx(self, node_idx1, node_idx2):
+        return self.retrieve_edge_indices(node_idx1, node_idx2)
+
+    def retrieve_edge_indices(self, node_idx1, node_idx2):
+        """Retrieve indices for both directions of the edge."""
+        (x1, y1), z1 = self.get_node_id(node_idx1)
+        (x2, y2), z2 = self.get_node_id(node_idx2)
+        # Order the pair as it was created: entity node first, then left/top terrain before right/bottom
+        flipped = (z2 == 1 and z1 != 1) or (z1 == z2 == 0 and (x1, y1) > (x2, y2))
+        if flipped:
+            (x1, y1), z1, (x2, y2), z2 = (x2, y2), z2, (x1, y1), z1
+        if z1 == 1 and z2 == 2:
+            direct = self.entity_player_edge[x1, y1]
+        elif z1 == 1 and z2 == 0 and (x1, y1) == (x2, y2):
+            direct = self.entity_terrain_edge[x1, y1]
+        elif z1 == 0 and z2 == 0 and (x2 - x1, y2 - y1) == (1, 0):
+            direct = self.right_edge[x1, y1]
+        elif z1 == 0 and z2 == 0 and (x2 - x1, y2 - y1) == (0, 1):
+            direct = self.down_edge[x1, y1]
+        else:
+            return None, None
+        direct = int(direct)
+        if flipped:
+            return direct + 1, direct
+        return direct, direct + 1
+
+    def get_tile_tensors(self, width, height):
+        return self.topology.tile_tensors
+
+    def get_khop(self, node_idx, num_hops, edge_index):
+        return self.topology.get_khop(node_idx, num_hops)
+
+    def get_window(self, center, radius, metric='box'):
+        return self.topology.get_window(center, radius, metric)
+
+    def set_max_edges(self, n):
+        assert n == self.max_edges, f"Grid layout has {self.max_edges} edges, not {n}"
@@ -1,9 +1,36 @@
 import time
+import random
 import functools
 import inspect
 
 ENABLE_TIMING = False
 
+# Consistency checks on the simulation hot paths are gated by a validation level:
+#   'off'   no checks
+#   'cheap' vectorised checks run once per world build or reset, no per-step cost (default)
+#   'full'  every check, including per-step scans of the whole grid
+# A sample rate also runs the checks above the level on that fraction of calls (test mode).
+VALIDATION_LEVELS = {'off': 0, 'cheap': 1, 'full': 2}
+validation_level = 'cheap'
+validation_sample_rate = 0.0
+validation_rng = random.Random(0)  # Own generator, so that sampling does not change the simulation
+
+def set_validation_level(level, sample_rate=0.0, seed=0):
+    global validation_level, validation_sample_rate, validation_rng
+    if level not in VALIDATION_LEVELS:
+        raise ValueError(f"Invalid validation level: {level}")
+    if not 0.0 <= sample_rate <= 1.0:
+        raise ValueError(f"Validation sample rate must be in [0, 1], not {sample_rate}")
+    validation_level = level
+    validation_sample_rate = sample_rate
+    validation_rng = random.Random(seed)
+
+def should_validate(level):
+    """Return True if the checks of this level ('cheap' or 'full') should run on this call."""
+    if VALIDATION_LEVELS[validation_level] >= VALIDATION_LEVELS[level]:
+        return True
+    return validation_sample_rate > 0.0 and validation_rng.random() < validation_sample_rate
+
 def time_function(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
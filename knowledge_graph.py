@@ -1,13 +1,14 @@
-from graph_idx_manager import Graph_Manager
+from graph_idx_manager import Graph_Manager, Grid_Graph_Manager
+from helper_functions import should_validate
 
 import torch
 from torch_geometric.data import Data
-from torch_geometric.utils import to_networkx, k_hop_subgraph
+from torch_geometric.utils import to_networkx
 import matplotlib.pyplot as plt
 import numpy as np
 
 class KnowledgeGraph():
-    def __init__(self, environment, vision_range, completion=1.0, plot=False):
+    def __init__(self, environment, vision_range, completion=1.0, plot=False, indexing='grid', subgraph_mode='khop', compact=False):
         self.environment = environment
         self.terrain_array = environment.terrain_index_grid
         self.entity_array = environment.entity_index_grid
@@ -17,9 +18,31 @@ class KnowledgeGraph():
 
         assert max(self.entity_array.flatten()) < 7, "Entity type exceeds the maximum value of 6"
 
-        self.graph_manager = Graph_Manager()
+        # 'grid' computes node and edge indices from the regular layout, 'dict' stores them in dictionaries
+        if indexing == 'grid':
+            self.graph_manager = Grid_Graph_Manager(environment.width, environment.height)
+        elif indexing == 'dict':
+            self.graph_manager = Graph_Manager()
+        else:
+            raise ValueError(f"Invalid indexing mode: {indexing}")
+
+        # 'khop' extracts observations with a BFS from the player's tile, 'box' and 'manhattan' select the
+        # tiles within self.distance of the player with index arithmetic (requires grid indexing)
+        if subgraph_mode not in ('khop', 'box', 'manhattan'):
+            raise ValueError(f"Invalid subgraph mode: {subgraph_mode}")
+        if subgraph_mode != 'khop' and indexing != 'grid':
+            raise ValueError(f"Subgraph mode {subgraph_mode} requires grid indexing")
+        self.subgraph_mode = subgraph_mode
+
+        # Compact storage keeps node features in uint8 (coordinates must fit) and edge attributes in int16
+        if compact and max(environment.width, environment.height) > 256:
+            raise ValueError(f"Compact storage supports maps of up to 256 tiles per side, not {environment.width}x{environment.height}")
+        self.compact = compact
+        self.node_dtype = torch.uint8 if compact else torch.int
+        self.edge_dtype = torch.int16 if compact else torch.int
 
         self.vision_range = vision_range
+        self.completion = completion
         self.distance = self.get_graph_distance(completion) # Graph distance, in terms of edges, from the player node
         self.discovered_coordinates = self.calculate_discovered_coordinates()
 
@@ -29,6 +52,7 @@ class KnowledgeGraph():
 
         self.init_graph_tensors()
         self.complete_graph()
+        self.init_subgraph_cache()
         # if plot:
         #     self.visualise_graph()
 
@@ -60,20 +84,60 @@ class KnowledgeGraph():
         self.graph_manager.set_max_edges(self.num_possible_edges)
         feature_size = 5 # x, y, z_level, type_id, mask
         edge_attr_size = 2 # distance, mask
+        if isinstance(self.graph_manager, Grid_Graph_Manager):
+            # The grid edge_index is shared by every world of the same size and never written in place
+            edge_index = self.graph_manager.topology.edge_index
+        else:
+            edge_index = torch.full((2, self.num_possible_edges), -1, dtype=torch.int)
         self.graph = Data(
-            x=torch.full((self.num_possible_nodes, feature_size), -1, dtype=torch.int),
-            edge_index=torch.full((2, self.num_possible_edges), -1, dtype=torch.int),
-            edge_attr=torch.full((self.num_possible_edges, edge_attr_size), -1, dtype=torch.int)
+            x=torch.full((self.num_possible_nodes, feature_size), -1, dtype=self.node_dtype),
+            edge_index=edge_index,
+            edge_attr=torch.full((self.num_possible_edges, edge_attr_size), -1, dtype=self.edge_dtype)
         )
         # Preallocated tensors for updates
-        self.single_node_feature = torch.empty((feature_size), dtype=torch.int)
-        self.single_edge_feature = torch.empty((edge_attr_size), dtype=torch.int)
+        self.single_node_feature = torch.empty((feature_size), dtype=self.node_dtype)
+        self.single_edge_feature = torch.empty((edge_attr_size), dtype=self.edge_dtype)
 
     def complete_graph(self):
-        self.add_nodes()
-        self.create_terrain_edges()
-        self.add_entity_edges()  
-        self.verify_graph_integrity()
+        if isinstance(self.graph_manager, Grid_Graph_Manager):
+            self.build_graph_tensors()
+        else:
+            self.add_nodes()
+            self.create_terrain_edges()
+            self.add_entity_edges()  
+            self.graph_manager.build_incidence_index()
+        self.init_player_distance_tensors()
+        if should_validate('cheap'):
+            self.verify_graph_integrity()
+
+    def build_graph_tensors(self):
+        """
+        Batch equivalent of add_nodes, create_terrain_edges and add_entity_edges for the grid layout.
+        Produces the same x and edge_attr directly from the terrain, entity and discovered grids,
+        edge_index comes from the shared grid topology.
+        """
+        graph_manager = self.graph_manager
+        graph_manager.create_idx(self.player_pos, self.player_z_level)
+        # Tiles are indexed in row-major (y, x) order, the (width, height) grids are transposed to match
+        xs, ys = np.meshgrid(np.arange(self.environment.width), np.arange(self.environment.height), indexing='ij')
+        discovered = self.discovered_coordinates
+        entity_mask = discovered * (self.entity_array != 0)
+        terrain_features = np.stack((xs, ys, np.full_like(xs, self.terrain_z_level), self.terrain_array, discovered), axis=-1)
+        entity_features = np.stack((xs, ys, np.full_like(xs, self.entity_z_level), self.entity_array, entity_mask), axis=-1)
+        tile_features = np.stack((terrain_features.transpose(1, 0, 2), entity_features.transpose(1, 0, 2)), axis=2)
+        player_features = (self.player_pos[0], self.player_pos[1], self.player_z_level, 0, 1)
+        self.graph.x[graph_manager.player_idx] = torch.tensor(player_features, dtype=self.node_dtype)
+        self.graph.x[1:] = torch.from_numpy(tile_features.reshape(-1, tile_features.shape[-1])).to(self.node_dtype)
+
+        edge_attr = np.ones((self.num_possible_edges, 2), dtype=np.int32)  # Terrain edges have distance 1 and are always active
+        entity_terrain_attr = np.stack((np.zeros_like(xs), entity_mask), axis=-1)
+        player_distance = np.abs(xs - self.player_pos[0]) + np.abs(ys - self.player_pos[1])
+        entity_player_attr = np.stack((player_distance, entity_mask), axis=-1)
+        for direct_edges, attr in ((graph_manager.entity_terrain_edge, entity_terrain_attr),
+                                   (graph_manager.entity_player_edge, entity_player_attr)):
+            edge_attr[direct_edges] = attr
+            edge_attr[direct_edges + 1] = attr
+        self.graph.edge_attr.copy_(torch.from_numpy(edge_attr))
 
     def count_entity_nodes(self):
         activated_entities = 0
@@ -89,11 +153,13 @@ class KnowledgeGraph():
         return activated_entities, deactivated_entities
 
     def verify_graph_integrity(self):
-        # Verify all nodes are initialized
-        assert torch.all(self.graph.x[:, 4] >= 0), "Some nodes are uninitialized."
+        # Verify all nodes are initialized, an unset mask is -1 (255 in compact storage)
+        assert torch.all((self.graph.x[:, 4] == 0) | (self.graph.x[:, 4] == 1)), "Some nodes are uninitialized."
         
         # Verify all edges are initialized
         assert torch.all(self.graph.edge_index >= 0), "Some edges are uninitialized."
+        if isinstance(self.graph_manager, Grid_Graph_Manager):
+            self.graph_manager.topology.check_edge_index()
         assert torch.all(self.graph.edge_attr[:, 1] >= 0), "Some edge attributes are uninitialized."
         
     def is_node_active(self, idx):
@@ -116,6 +182,39 @@ class KnowledgeGraph():
             self.activate_node_and_maybe_its_edges(self.graph_manager.get_node_idx((x, y), self.entity_z_level))
         return True
 
+    def discover_region(self, mask):
+        """
+        Discover every tile of a boolean (width, height) mask in one pass: activate the terrain nodes of the
+        new tiles, their entity nodes and every incident edge whose endpoints are both active.
+        Equivalent to discover_this_coordinate on each tile, returns the number of newly discovered tiles.
+        """
+        new_tiles = np.asarray(mask, dtype=bool) & (self.discovered_coordinates == 0)
+        discovered_now = int(new_tiles.sum())
+        if discovered_now == 0:
+            return 0
+        self.discovered_coordinates[new_tiles] = 1
+
+        new_tiles = torch.from_numpy(new_tiles.ravel())
+        has_entity = torch.from_numpy(self.entity_array.ravel() > 1)
+        nodes = torch.cat((self.terrain_node_idx[new_tiles], self.entity_node_idx[new_tiles & has_entity]))
+        self.graph.x[nodes, 4] = 1
+        self.nodes_dirty = True
+
+        edges = self.graph_manager.get_incident_edges_of_nodes(nodes.numpy())
+        sources, targets = torch.from_numpy(self.graph_manager.edge_nodes[:, edges])
+        active = (self.graph.x[sources, 4] == 1) & (self.graph.x[targets, 4] == 1)
+        if active.any():
+            self.graph.edge_attr[torch.from_numpy(edges)[active], 1] = 1
+            self.edges_dirty = True
+        return discovered_now
+
+    def get_region_mask(self, center, radius):
+        """Return a boolean (width, height) mask of the tiles within a square of the given radius around center."""
+        x, y = center
+        mask = np.zeros(self.terrain_array.shape, dtype=bool)
+        mask[max(x - radius, 0):x + radius + 1, max(y - radius, 0):y + radius + 1] = True
+        return mask
+
     def activate_node_and_maybe_its_edges(self, idx):
         self.set_node_mask_1(idx)
         # activate the nodes edges if the corresponding node is activated
@@ -132,43 +231,48 @@ class KnowledgeGraph():
 
     def check_edges_active_of_node(self, idx):
         print(f"Checking edges of node {idx}")
-        for edge in self.graph_manager.nodeTuples_edgeIdx_dict:
-            if idx in edge:
-                print(f"Edge {edge} is connected to node {idx}")
-                edge_idx_1, edge_idx_2 = self.graph_manager.retrieve_edge_indices(edge[0], edge[1])
-                if self.graph.edge_attr[edge_idx_1][1] == 0:
-                    print(f"Edge {edge_idx_1} is not active")
-                if self.graph.edge_attr[edge_idx_2][1] == 0:
-                    print(f"Edge {edge_idx_2} is not active")
+        for edge in self.graph_manager.retrieve_edge_node_pairs_from_node(idx):
+            print(f"Edge {edge} is connected to node {idx}")
+            edge_idx_1, edge_idx_2 = self.graph_manager.retrieve_edge_indices(edge[0], edge[1])
+            if self.graph.edge_attr[edge_idx_1][1] == 0:
+                print(f"Edge {edge_idx_1} is not active")
+            if self.graph.edge_attr[edge_idx_2][1] == 0:
+                print(f"Edge {edge_idx_2} is not active")
 
     def deactivate_node_and_its_edges(self, node_idx):
         self.set_node_mask_0(node_idx)
         edge_indices = self.graph_manager.retrieve_edge_indicies_from_node(node_idx)
-        for edge_idx in edge_indices:
-            self.set_edge_mask_0(edge_idx)
+        self.graph.edge_attr[edge_indices, 1] = 0
+        self.edges_dirty = True
 
     def set_new_node_type(self, idx, new_type):
         self.graph.x[idx][3] = new_type
+        self.nodes_dirty = True
 
     def set_node_mask_0(self, idx):
         self.graph.x[idx][4] = 0
+        self.nodes_dirty = True
 
     def set_node_mask_1(self, idx):
         # x, y, z_level, type_id, mask
         self.graph.x[idx][4] = 1
+        self.nodes_dirty = True
 
     def set_edge_mask_0(self, idx):
         self.graph.edge_attr[idx][1] = 0
+        self.edges_dirty = True
 
     def set_edge_mask_1(self, idx):
         self.graph.edge_attr[idx][1] = 1
+        self.edges_dirty = True
 
     def build_path_node(self, x, y):
         assert self.entity_array[x, y] == 6, "Entity type is not 6"
         node_idx = self.graph_manager.get_node_idx((x, y), self.entity_z_level)
         self.set_new_node_type(node_idx, self.entity_array[x, y])
         self.activate_node_and_maybe_its_edges(node_idx)
-        self.check_entites_active()
+        if should_validate('full'):
+            assert self.check_entites_active(), "Discovered entities are inactive"
 
     def elevate_terrain_node(self, x, y):
         self.terrain_array[x, y] += 1
@@ -187,38 +291,80 @@ class KnowledgeGraph():
         # change player node features
         self.graph.x[self.graph_manager.player_idx][0] = x
         self.graph.x[self.graph_manager.player_idx][1] = y
+        self.nodes_dirty = True
         # recalculate edge distances to player
         self.recalculate_edge_distances_to_player()
 
+    def set_completeness(self, completion):
+        """
+        Switch the completeness of the graph: the discovered coordinates become the square of the new
+        graph distance around the player and the node and edge masks are rewritten to match, as if the
+        graph had been built with this completeness. Terrain edges stay active.
+        """
+        if completion == self.completion:
+            return
+        self.completion = completion
+        self.distance = self.get_graph_distance(completion)
+        self.discovered_coordinates = self.calculate_discovered_coordinates()
+
+        discovered = torch.from_numpy(self.discovered_coordinates.ravel() != 0)
+        has_entity = torch.from_numpy(self.entity_array.ravel() != 0)
+        self.graph.x[self.terrain_node_idx, 4] = discovered.to(self.node_dtype)
+        self.graph.x[self.entity_node_idx, 4] = (discovered & has_entity).to(self.node_dtype)
+
+        sources, targets = self.graph_manager.edge_nodes_tensor
+        active = (self.graph.x[sources, 4] == 1) & (self.graph.x[targets, 4] == 1)
+        terrain_edge = (self.graph.x[sources, 2] == self.terrain_z_level) & (self.graph.x[targets, 2] == self.terrain_z_level)
+        self.graph.edge_attr[:, 1] = (active | terrain_edge).to(self.edge_dtype)
+        self.nodes_dirty = True
+        self.edges_dirty = True
+
+    def take_snapshot(self):
+        """Return a copy of the mutable graph state, to be restored with restore_snapshot."""
+        return {
+            'x': self.graph.x.clone(),
+            'edge_attr': self.graph.edge_attr.clone(),
+            'discovered_coordinates': self.discovered_coordinates.copy(),
+            'player_pos': self.player_pos,
+            'completion': self.completion,
+            'distance': self.distance
+        }
+
+    def restore_snapshot(self, snapshot):
+        """Restore the state returned by take_snapshot. The environment grids are restored by the environment."""
+        self.graph.x.copy_(snapshot['x'])
+        self.graph.edge_attr.copy_(snapshot['edge_attr'])
+        self.discovered_coordinates = snapshot['discovered_coordinates'].copy()
+        self.player_pos = snapshot['player_pos']
+        self.completion = snapshot['completion']
+        self.distance = snapshot['distance']
+        self.nodes_dirty = True
+        self.edges_dirty = True
+
+    def init_player_distance_tensors(self):
+        """Look up the coordinates, node indices and entity->player edge index of every tile, in (x, y) order."""
+        self.tile_xs, self.tile_ys, self.terrain_node_idx, self.entity_node_idx, self.entity_player_edge_idx = \
+            self.graph_manager.get_tile_tensors(self.environment.width, self.environment.height)
+
     def recalculate_edge_distances_to_player(self):
-        height, width = self.entity_array.shape
-        for x in range(width):
-            for y in range(height):
-                if not self.discovered_coordinates[x, y]:
-                    continue
-                if self.entity_array[x, y] > 1:
-                    entity_idx = self.graph_manager.get_node_idx((x, y), self.entity_z_level)
-                    if entity_idx is not None and self.is_node_active(entity_idx):
-                        player_idx = self.graph_manager.player_idx
-                        entity_pos = (x, y)
-                        player_pos = self.player_pos
-                        distance = self.get_cartesian_distance(entity_pos, player_pos)
-                        edge_indices = self.graph_manager.retrieve_edge_indices(entity_idx, player_idx)
-                        if edge_indices:
-                            edge_idx_1, edge_idx_2 = edge_indices
-                            self.graph.edge_attr[edge_idx_1][0] = distance
-                            self.graph.edge_attr[edge_idx_2][0] = distance
-                        else:
-                            print(f"No edge indices found for nodes {entity_idx} and {player_idx}")
-                    else:
-                        print(f"Entity node {entity_idx} at position {(x, y)} is not active or not found")
+        # Only discovered and active entities other than fish carry an up to date distance to the player
+        discovered = torch.from_numpy(self.discovered_coordinates.ravel() != 0)
+        has_entity = torch.from_numpy(self.entity_array.ravel() > 1)
+        active = self.graph.x[self.entity_node_idx, 4] == 1
+        selected = discovered & has_entity & active
+        edge_indices = self.entity_player_edge_idx[selected]
+        distance = (self.tile_xs[selected] - self.player_pos[0]).abs() + (self.tile_ys[selected] - self.player_pos[1]).abs()
+        distance = distance.to(self.graph.edge_attr.dtype)
+        self.graph.edge_attr[edge_indices, 0] = distance
+        self.graph.edge_attr[edge_indices + 1, 0] = distance
+        self.edges_dirty = True
 
     def create_node(self, coordinates, z_level, mask=0):
         features = self.create_node_features(coordinates, z_level, mask)
         if features is None:
             return None
         node_idx = self.graph_manager.create_idx(coordinates, z_level)
-        self.graph.x[node_idx] = torch.tensor(features, dtype=torch.int)
+        self.graph.x[node_idx] = torch.tensor(features, dtype=self.node_dtype)
         return node_idx
     
     def add_nodes(self):
@@ -248,8 +394,8 @@ class KnowledgeGraph():
     def add_edge_to_graph(self, idx1, idx2, distance, active, direct_edge_idx, reverse_edge_idx):
         self.graph.edge_index[:, direct_edge_idx] = torch.tensor([idx1, idx2], dtype=torch.int)
         self.graph.edge_index[:, reverse_edge_idx] = torch.tensor([idx2, idx1], dtype=torch.int)
-        self.graph.edge_attr[direct_edge_idx] = torch.tensor([distance, active], dtype=torch.float)
-        self.graph.edge_attr[reverse_edge_idx] = torch.tensor([distance, active], dtype=torch.float)
+        self.graph.edge_attr[direct_edge_idx] = torch.tensor([distance, active], dtype=self.edge_dtype)
+        self.graph.edge_attr[reverse_edge_idx] = torch.tensor([distance, active], dtype=self.edge_dtype)
 
     def create_terrain_edges(self):
         height, width = self.environment.height, self.environment.width
@@ -275,30 +421,17 @@ class KnowledgeGraph():
                 self.create_edge(entity_idx, (x, y), self.graph_manager.player_idx, self.player_pos)
 
     def calculate_discovered_coordinates(self):
-        # discovered = np.full_like(self.terrain_array, False, dtype=bool)
-        discovered = np.zeros_like(self.terrain_array, dtype=int)
-        for x in range(self.player_pos[0] - self.distance, self.player_pos[0] + self.distance + 1):
-            for y in range(self.player_pos[1] - self.distance, self.player_pos[1] + self.distance + 1):
-                if self.environment.within_bounds(x, y):
-                    discovered[x, y] = 1
-        return discovered
+        return self.get_region_mask(self.player_pos, self.distance).astype(int)
     
     def set_current_completness(self):
-        # set all discovered coordinates to 0
-        self.discovered_coordinates = np.zeros_like(self.terrain_array, dtype=int)
-        for x in range(self.player_pos[0] - self.distance, self.player_pos[0] + self.distance + 1):
-            for y in range(self.player_pos[1] - self.distance, self.player_pos[1] + self.distance + 1):
-                if self.environment.within_bounds(x, y):
-                    self.discovered_coordinates[x, y] = 1
+        # Reset the discovered coordinates to the square of self.distance around the player
+        self.discovered_coordinates = self.calculate_discovered_coordinates()
 
     def compute_total_possible_edges(self):
         # Intra-terrain edges   
         terrain_edges = 2 * ((self.environment.width * (self.environment.height - 1)) + (self.environment.height * (self.environment.width - 1)))
         # Entity edges to terrain nodes and player node
-        entity_edges = 0
-        for _ in range(self.environment.width):
-            for _ in range(self.environment.height):
-                entity_edges += 4 # 2 edges to terrain nodes and 2 to the player node
+        entity_edges = 4 * self.environment.width * self.environment.height # 2 edges to terrain nodes and 2 to the player node
         
         return terrain_edges + entity_edges, terrain_edges, entity_edges
 
@@ -320,19 +453,15 @@ class KnowledgeGraph():
         return neighbours
     
     def check_entites_active(self):
-        flag = False
-        for y in range(self.environment.height):
-            for x in range(self.environment.width):
-                if not self.discovered_coordinates[x, y]:
-                    continue
-                if self.entity_array[x, y] > 1:
-                    entity_idx = self.graph_manager.get_node_idx((x, y), self.entity_z_level)
-                    if not self.is_node_active(entity_idx):
-                        print(f"Entity node {entity_idx} at position {(x, y)} is not active")
-                        flag = True
-
-        if flag:
+        active = (self.graph.x[self.entity_node_idx, 4] == 1).numpy().reshape(self.entity_array.shape)
+        inactive = (self.discovered_coordinates != 0) & (self.entity_array > 1) & ~active
+        for y, x in zip(*np.nonzero(inactive.T)):
+            entity_idx = self.graph_manager.get_node_idx((x, y), self.entity_z_level)
+            print(f"Entity node {entity_idx} at position {(x, y)} is not active")
+
+        if inactive.any():
             print(self.entity_array)
+        return not inactive.any()
 
     def check_path_nodes(self):
         for node_idx in range(self.graph.x.shape[0]):
@@ -404,19 +533,76 @@ class KnowledgeGraph():
             return (0, 0, 0)  # black for player
         return None
 
+    def init_subgraph_cache(self):
+        # The k-hop structure only depends on the start node and the number of hops, as edge_index never changes.
+        # Node features and edge attributes are gathered again only when they were written since the last call.
+        self.subgraph_key = None
+        self.subgraph_structure = None
+        self.subgraph_data = None
+        self.nodes_dirty = True
+        self.edges_dirty = True
+        self.subgraph_cache_hits = 0  # Cached tensors returned as they were
+        self.subgraph_cache_refreshes = 0  # Features gathered again over the cached structure
+        self.subgraph_cache_misses = 0  # k-hop BFS rerun
+        self.active_subgraph_source = None  # Subgraph that active_subgraph was packed from
+        self.active_subgraph = None
+
+    def subgraph_cache_hit_rate(self):
+        calls = self.subgraph_cache_hits + self.subgraph_cache_refreshes + self.subgraph_cache_misses
+        return self.subgraph_cache_hits / calls if calls else 0.0
+
     def get_subgraph(self):
+        """
+        Return the subgraph around the player, either the k-hop neighbourhood of its tile or the
+        window of tiles within self.distance. The result is cached, so the returned tensors must
+        be treated as read-only by the caller.
+        """
         node_idx = self.graph_manager.get_node_idx(self.player_pos, self.terrain_z_level)
+        key = (node_idx, self.distance)
 
-        subset, edge_index, mapping, edge_mask = k_hop_subgraph(
-            node_idx=node_idx,
-            num_hops=self.distance,
-            edge_index=self.graph.edge_index
-        )
+        if key != self.subgraph_key:
+            if self.subgraph_mode == 'khop':
+                subset, edge_index, edge_mask = self.graph_manager.get_khop(node_idx, self.distance, self.graph.edge_index)
+            else:
+                subset, edge_mask, edge_index = (torch.from_numpy(table) for table in
+                    self.graph_manager.get_window(self.player_pos, self.distance, self.subgraph_mode))
+            self.subgraph_key = key
+            self.subgraph_structure = (subset, edge_index, edge_mask)
+            self.subgraph_cache_misses += 1
+        elif self.nodes_dirty or self.edges_dirty:
+            self.subgraph_cache_refreshes += 1
+        else:
+            self.subgraph_cache_hits += 1
+            return self.subgraph_data
 
+        subset, edge_index, edge_mask = self.subgraph_structure
         subgraph_data = Data(
             x=self.graph.x[subset],  # Node features of the subgraph
             edge_index=edge_index,   # Edges of the subgraph
             edge_attr=self.graph.edge_attr[edge_mask]  # Edge attributes of the subgraph
         )
+        self.subgraph_data = subgraph_data
+        self.nodes_dirty = False
+        self.edges_dirty = False
 
         return subgraph_data
+
+    def get_active_subgraph(self):
+        """
+        The subgraph around the player restricted to its active nodes and the active edges between them,
+        edge_index renumbered over the kept nodes. Packed again only when get_subgraph returns new tensors.
+        """
+        subgraph = self.get_subgraph()
+        if subgraph is self.active_subgraph_source:
+            return self.active_subgraph
+        node_active = subgraph.x[:, -1] == 1
+        new_node_idx = torch.cumsum(node_active, 0) - 1
+        edge_index = subgraph.edge_index.long()
+        edge_active = (subgraph.edge_attr[:, -1] == 1) & node_active[edge_index[0]] & node_active[edge_index[1]]
+        self.active_subgraph = Data(
+            x=subgraph.x[node_active],
+            edge_index=new_node_idx[edge_index[:, edge_active]].to(subgraph.edge_index.dtype),
+            edge_attr=subgraph.edge_attr[edge_active]
+        )
+        self.active_subgraph_source = subgraph
+        return self.active_subgraph
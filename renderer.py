@@ -1,7 +1,10 @@
+import numpy as np
 import pygame
 
 from environment import Environment
 from agent import Agent
+from entities import ENTITY_CLASSES, Entity, Player
+from terrains import Terrain
 
 class Renderer:
     def __init__(self, environment: Environment, agent_control: Agent):
@@ -135,3 +138,108 @@ class Renderer:
         font = pygame.font.Font(None, 24)
         text = font.render(label, True, (255, 255, 255))
         self.surface.blit(text, (x + bar_length + 5, y))
+
+class Vision_Rasterizer:
+    """
+    Draws the vision window around the player from the environment's arrays, it needs neither a display nor
+    sprites so it also renders headless worlds. Every combination of terrain, entity and player is drawn once
+    per tile size with pygame into an atlas, a window is then gathered from the atlas by the tile codes and
+    written into a reused (3, W, H) buffer. The window is clamped to the map like the crop of the display.
+    A float16 copy of the atlas holds the pixels divided by 255, the normalised vision of CustomEnv.
+    The symbolic vision gathers one-hot elevation, entity and player channels per tile from the same codes.
+    """
+    _atlases = {}
+    num_elevations = 6
+    num_entity_ids = Player.id  # Ids below the player, the player is drawn on top of them
+    num_symbolic_channels = num_elevations + num_entity_ids  # Entity ids 1 to 6 and the player
+
+    def __init__(self, environment: Environment, vision_range: int):
+        self.environment = environment
+        self.tile_size = environment.tile_size
+        self.vision_range = vision_range
+        self.window_tiles = 2 * vision_range + 1
+        self.player_offset = self.num_elevations * self.num_entity_ids
+        # Pixel atlases and buffers are made on the first render, symbolic vision needs no images
+        self.atlases = {}
+        self.visions = {}
+        self.symbols = self.get_symbol_table()
+        self.symbolic_vision = np.empty((self.num_symbolic_channels, self.window_tiles, self.window_tiles), dtype=np.uint8)
+
+    @classmethod
+    def get_atlas(cls, tile_size, normalised=False):
+        """(2 * elevations * entity ids, 3, tile_size, tile_size) uint8 tiles, the second half with the player on top."""
+        if normalised:
+            if (tile_size, normalised) not in cls._atlases:
+                cls._atlases[(tile_size, normalised)] = cls.get_atlas(tile_size).astype(np.float16) / 255.0
+            return cls._atlases[(tile_size, normalised)]
+        if tile_size not in cls._atlases:
+            tile = pygame.Surface((tile_size, tile_size))
+            tiles = []
+            for player in (False, True):
+                for elevation in range(cls.num_elevations):
+                    for entity_id in range(cls.num_entity_ids):
+                        tile.fill(Terrain.set_colour(elevation))
+                        if entity_id != 0:
+                            tile.blit(Entity.load_image(ENTITY_CLASSES[entity_id].art, tile_size), (0, 0))
+                        if player:
+                            tile.blit(Entity.load_image(Player.art, tile_size), (0, 0))
+                        tiles.append(np.transpose(pygame.surfarray.array3d(tile), (2, 0, 1)))
+            cls._atlases[tile_size] = np.stack(tiles)
+        return cls._atlases[tile_size]
+
+    @classmethod
+    def get_symbol_table(cls):
+        """(tile codes, symbolic channels) uint8 one-hot rows: elevation, entity id 1 to 6 and the player."""
+        codes = np.arange(2 * cls.num_elevations * cls.num_entity_ids)
+        player, code = np.divmod(codes, cls.num_elevations * cls.num_entity_ids)
+        elevation, entity_id = np.divmod(code, cls.num_entity_ids)
+        symbols = np.zeros((len(codes), cls.num_symbolic_channels), dtype=np.uint8)
+        symbols[codes, elevation] = 1
+        has_entity = entity_id != 0
+        symbols[codes[has_entity], cls.num_elevations + entity_id[has_entity] - 1] = 1
+        symbols[:, -1] = player
+        return symbols
+
+    def get_window_origin(self):
+        player = self.environment.player
+        x = min(max(player.grid_x - self.vision_range, 0), self.environment.width - self.window_tiles)
+        y = min(max(player.grid_y - self.vision_range, 0), self.environment.height - self.window_tiles)
+        return x, y
+
+    def get_tile_codes(self):
+        origin_x, origin_y = self.get_window_origin()
+        window = (slice(origin_x, origin_x + self.window_tiles), slice(origin_y, origin_y + self.window_tiles))
+        entity_ids = self.environment.entity_index_grid[window]
+        codes = self.environment.elevation[window].astype(np.intp) * self.num_entity_ids
+        codes += np.where(entity_ids == Player.id, 0, entity_ids)
+        player = self.environment.player
+        codes[player.grid_x - origin_x, player.grid_y - origin_y] += self.player_offset
+        return codes
+
+    def render(self, normalised=False, out=None):
+        """
+        Return the vision window as (3, W, H) pixels, the layout of the vision observation: uint8, or float16
+        in [0, 1] when normalised. It is written into out if given, else into a buffer reused by the next
+        call, copy it to keep it.
+        """
+        if normalised not in self.atlases:
+            self.atlases[normalised] = self.get_atlas(self.tile_size, normalised)
+        if out is None:
+            if normalised not in self.visions:
+                side = self.window_tiles * self.tile_size
+                self.visions[normalised] = np.empty((3, side, side), dtype=self.atlases[normalised].dtype)
+            out = self.visions[normalised]
+        tiles = self.atlases[normalised][self.get_tile_codes()]  # (tile column, tile row, channel, pixel column, pixel row)
+        # The output split into tiles: channel, tile column, pixel column, tile row, pixel row
+        out_tiles = out.reshape(3, self.window_tiles, self.tile_size, self.window_tiles, self.tile_size)
+        np.copyto(out_tiles, tiles.transpose(2, 0, 3, 1, 4))
+        return out
+
+    def render_symbolic(self, out=None):
+        """
+        Return the vision window at tile resolution as (channels, W, H) uint8 one-hot ids, see get_symbol_table.
+        It is written into out if given, else into a buffer reused by the next call, copy it to keep it.
+        """
+        out = self.symbolic_vision if out is None else out
+        np.copyto(out, self.symbols[self.get_tile_codes()].transpose(2, 0, 1))
+        return out
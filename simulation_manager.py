@@ -1,17 +1,23 @@
 import numpy as np
 import time
+import random
+import bisect
 import matplotlib.pyplot as plt
 import csv
 from collections import deque
-from game_manager import GameManager
+from concurrent.futures import ProcessPoolExecutor
+from game_manager import GameManager, generate_world_spec
 import logging
 logger = logging.getLogger(__name__)
 
 class SimulationManager:
     def __init__(self, game_manager_args, number_of_environments=500, number_of_curricula=10,
-                 min_episodes_per_curriculum=1, plot=False):
+                 min_episodes_per_curriculum=1, plot=False, num_workers=1, seed=None):
         self.number_of_environments = number_of_environments
         self.logger = logger
+        # With several workers or a seed the worlds are generated from seeds, see generate_world_specs
+        self.num_workers = num_workers
+        self.seed = seed
         self.game_managers = []
         self.create_games(self.number_of_environments, game_manager_args, plot)
         number_of_curricula = min(max(1, number_of_curricula), number_of_environments // 2)
@@ -20,19 +26,10 @@ class SimulationManager:
         self.step_size = round(step_size, 2)
         energy_values = [gm.target_manager.target_route_energy for gm in self.game_managers]
 
-        self.current_curriculum_index = 0
         self.min_episodes_per_curriculum = min_episodes_per_curriculum
-        self.current_curriculum_episodes = 0
-        self.performance_window = deque(maxlen=100)
-        self.performance_threshold = 0.6  # 70% of max possible reward for current level
         self.max_performance = max(gm.target_manager.target_route_energy for gm in self.game_managers)
-        self.success_rate_threshold = 0.5  # New threshold for task completion rate
-        self.success_window = deque(maxlen=100)  # New window to track task completion
-
-        # Plateau detection
         self.plateau_threshold = 50  # Number of episodes to detect a plateau
-        self.plateau_counter = 0
-        self.best_performance = float('-inf')
+        self.reset_curriculum()
 
         # Sanity Check
         self.print_energy_routes()
@@ -41,19 +38,65 @@ class SimulationManager:
         if plot:
             self.create_plots(energy_values, self.curriculum_indices)
 
+    def reset_curriculum(self):
+        """Start the curriculum from the first level, so that the worlds can be reused by another experiment."""
+        self.current_curriculum_index = 0
+        self.current_curriculum_episodes = 0
+        self.performance_window = deque(maxlen=100)
+        self.performance_threshold = 0.6  # 70% of max possible reward for current level
+        self.success_rate_threshold = 0.5  # New threshold for task completion rate
+        self.success_window = deque(maxlen=100)  # New window to track task completion
+
+        # Plateau detection
+        self.plateau_counter = 0
+        self.best_performance = float('-inf')
+
     def create_games(self, number_of_games, game_manager_args, plot):
         num_tiles = game_manager_args['num_tiles']
         screen_size = game_manager_args['screen_size']
         vision_range = game_manager_args['vision_range']
-        for _ in range(number_of_games):
-            game_manager = GameManager(num_tiles, screen_size, vision_range, plot)
-            if len(game_manager.environment.outpost_locations) >= 3:
+        subgraph_mode = game_manager_args.get('subgraph_mode', 'khop')
+        compact = game_manager_args.get('compact', False)
+        headless = game_manager_args.get('headless', False)
+        number_of_outposts = game_manager_args.get('number_of_outposts', 3)
+        from_specs = self.num_workers > 1 or self.seed is not None
+        if from_specs:
+            master_seed = self.seed if self.seed is not None else random.getrandbits(64)
+            random_state = random.getstate()  # Generating worlds in this process reseeds random
+            world_specs = self.generate_world_specs(number_of_games, master_seed, num_tiles, screen_size // num_tiles,
+                                                    number_of_outposts)
+        else:
+            world_specs = [None] * number_of_games
+        for world_spec in world_specs:
+            game_manager = GameManager(num_tiles, screen_size, vision_range, plot, subgraph_mode=subgraph_mode,
+                                       compact=compact, headless=headless, number_of_outposts=number_of_outposts,
+                                       world_spec=world_spec)
+            if len(game_manager.environment.outpost_locations) >= number_of_outposts:
                 self.insert_game_manager_sorted(game_manager)
+        if from_specs:
+            random.setstate(random_state)
+
+    def generate_world_specs(self, number_of_games, master_seed, num_tiles, tile_size, number_of_outposts):
+        """
+        Generate the worlds across num_workers processes and yield their specs in order, as they come, so that the
+        GameManagers are built over them here while the workers go on. Every world has its own seed drawn from the
+        master seed, so the worlds only depend on it and not on the number of workers.
+        """
+        master_random = random.Random(master_seed)
+        world_seeds = [master_random.getrandbits(64) for _ in range(number_of_games)]
+        world_args = ([num_tiles] * number_of_games, [tile_size] * number_of_games,
+                      [number_of_outposts] * number_of_games, world_seeds)
+        if self.num_workers <= 1:
+            yield from map(generate_world_spec, *world_args)
+            return
+        chunk_size = max(1, number_of_games // (4 * self.num_workers))
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            yield from executor.map(generate_world_spec, *world_args, chunksize=chunk_size)
 
     def insert_game_manager_sorted(self, game_manager):
         energy = game_manager.target_manager.target_route_energy
         if energy > 0:
-            index = next((i for i, gm in enumerate(self.game_managers) if energy < gm.target_manager.target_route_energy), len(self.game_managers))
+            index = bisect.bisect_right(self.game_managers, energy, key=lambda gm: gm.target_manager.target_route_energy)
             self.game_managers.insert(index, game_manager)
 
     def get_current_game_manager(self):
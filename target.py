@@ -1,53 +1,337 @@
-import networkx as nx
 from scipy.spatial.distance import pdist, squareform
-from itertools import permutations
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
 import numpy as np
-from queue import PriorityQueue
+import heapq
+from itertools import chain
+
+_grid_moves = {}
+
+def get_grid_moves(width, height):
+    """
+    Return the moves between 4-neighbour cells of a map of this size as the (indptr, indices) of a CSR matrix,
+    cells indexed x * height + y, so that only the move costs are filled in per map. Shared by every map of the same size.
+    """
+    key = (width, height)
+    if key not in _grid_moves:
+        cells = np.arange(width * height).reshape(width, height)
+        pairs = np.concatenate((
+            np.stack((cells[:-1, :].ravel(), cells[1:, :].ravel())),
+            np.stack((cells[:, :-1].ravel(), cells[:, 1:].ravel()))
+        ), axis=1)
+        sources, targets = np.concatenate((pairs, pairs[::-1]), axis=1)
+        order = np.lexsort((targets, sources))
+        indptr = np.searchsorted(sources[order], np.arange(width * height + 1)).astype(np.int32)
+        _grid_moves[key] = (indptr, targets[order].astype(np.int32))
+    return _grid_moves[key]
+
+_grid_neighbours = {}
+
+def get_grid_neighbours(width, height):
+    """Return the tuple of 4-neighbour cells of every cell of a map of this size, as get_grid_moves, for Python loops."""
+    key = (width, height)
+    if key not in _grid_neighbours:
+        indptr, targets = get_grid_moves(width, height)
+        targets = targets.tolist()
+        _grid_neighbours[key] = [tuple(targets[start:end]) for start, end in zip(indptr[:-1].tolist(), indptr[1:].tolist())]
+    return _grid_neighbours[key]
+
+def held_karp_tour(energy):
+    """
+    Exact shortest closed tour over the outposts of an energy matrix, by Held-Karp dynamic programming over the
+    subsets of outposts in O(2^n n^2), one NumPy pass per subset size and last outpost.
+    Returns the tour as outpost indices, starting and ending at outpost 0, and its energy.
+    """
+    n = len(energy)
+    if n <= 2:
+        tour = list(range(n)) + [0]
+        return tour, int(sum(energy[a, b] for a, b in zip(tour, tour[1:])))
+    m = n - 1  # Outposts after the start, bit j of a subset is outpost j + 1
+    cost = energy[1:, 1:].astype(np.float64)
+    subsets = np.arange(1 << m)
+    subset_sizes = np.zeros(1 << m, dtype=np.int64)
+    for j in range(m):
+        subset_sizes += (subsets >> j) & 1
+    # best[subset, j]: least energy from outpost 0 through the subset, ending at outpost j + 1
+    best = np.full((1 << m, m), np.inf)
+    parent = np.full((1 << m, m), -1, dtype=np.int64)
+    best[1 << np.arange(m), np.arange(m)] = energy[0, 1:]
+    for size in range(2, m + 1):
+        level = subsets[subset_sizes == size]
+        for j in range(m):
+            ending = level[(level >> j) & 1 == 1]
+            candidates = best[ending ^ (1 << j)] + cost[:, j]
+            previous = candidates.argmin(axis=1)
+            best[ending, j] = candidates[np.arange(len(ending)), previous]
+            parent[ending, j] = previous
+    closing = best[-1] + energy[1:, 0]
+    last = int(closing.argmin())
+
+    tour = []
+    subset, j = (1 << m) - 1, last
+    while j != -1:
+        tour.append(j + 1)
+        subset, j = subset ^ (1 << j), int(parent[subset, j])
+    return [0] + tour[::-1] + [0], int(closing[last])
+
+def local_search_tour(energy, max_segment=3):
+    """
+    Closed tour over the outposts of a symmetric energy matrix, from the nearest neighbour tour improved by 2-opt
+    (reversing a stretch of the tour) and Or-opt (moving a run of up to max_segment outposts, either way round, to
+    another place) until neither shortens it. Same return as held_karp_tour, not necessarily optimal.
+    """
+    n = len(energy)
+    if n <= 3:
+        return held_karp_tour(energy)
+    energy = energy.astype(np.int64)
+    tour = [0]
+    unvisited = np.ones(n, dtype=bool)
+    unvisited[0] = False
+    for _ in range(n - 1):
+        nearest = int(np.where(unvisited, energy[tour[-1]], np.iinfo(np.int64).max).argmin())
+        tour.append(nearest)
+        unvisited[nearest] = False
+    tour = np.array(tour)
+
+    improved = True
+    while improved:
+        improved = False
+        # 2-opt: replace edges (a, b) and (c, d) by (a, c) and (b, d), reversing b..c
+        for i in range(n - 2):
+            a, b = tour[i], tour[i + 1]
+            c, d = tour[i + 2:], np.roll(tour, -1)[i + 2:]
+            gains = energy[a, b] + energy[c, d] - energy[a, c] - energy[b, d]
+            if i == 0:
+                gains[-1] = 0  # (c, d) would close onto a
+            k = int(gains.argmax())
+            if gains[k] > 0:
+                tour[i + 1:i + k + 3] = tour[i + 1:i + k + 3][::-1]
+                improved = True
+        # Or-opt: move the run tour[i:i + length] between two consecutive outposts of the rest of the tour
+        for length in range(1, max_segment + 1):
+            i = 1
+            while i + length <= n:
+                run, rest = tour[i:i + length], np.concatenate((tour[:i], tour[i + length:]))
+                first, last = run[0], run[-1]
+                removal_gain = energy[rest[i - 1], first] + energy[last, rest[i % len(rest)]] - energy[rest[i - 1], rest[i % len(rest)]]
+                u, v = rest, np.roll(rest, -1)
+                forward = energy[u, first] + energy[last, v] - energy[u, v]
+                backward = energy[u, last] + energy[first, v] - energy[u, v]
+                insertion = np.minimum(forward, backward)
+                insertion[i - 1] = removal_gain  # Putting the run back where it was
+                k = int(insertion.argmin())
+                if insertion[k] < removal_gain:
+                    if backward[k] < forward[k]:
+                        run = run[::-1]
+                    tour = np.concatenate((rest[:k + 1], run, rest[k + 1:]))
+                    improved = True
+                i += 1
+
+    start = int(np.flatnonzero(tour == 0)[0])
+    tour = [int(outpost) for outpost in np.roll(tour, -start)] + [0]
+    return tour, int(sum(energy[a, b] for a, b in zip(tour, tour[1:])))
 
 class Target_Manager:
-    def __init__(self, environment):
+    use_heuristic = True  # Search route legs with A*, see least_energy_search
+    held_karp_max_outposts = 15  # Larger trade routes are planned by local search
+
+    def __init__(self, environment, tsp_solver=None, route_state=None):
         self.environment = environment
+        # A function of the outpost energy matrix returning (tour, energy), by default picked by the number of outposts
+        self.tsp_solver = tsp_solver
         self.width, self.height = environment.width, environment.height
         self.terrain_index_grid = environment.terrain_index_grid
         self.entity_index_grid = environment.entity_index_grid
         self.outpost_locations = environment.outpost_locations
         
         self.energy_req_grid = self.get_energy_grid()
+        # Least energy between every pair of outposts, rows and columns in the order of outpost_locations
+        self.outpost_index = {coord: index for index, coord in enumerate(self.outpost_locations)}
+        self.outpost_cells = np.array([x * self.height + y for x, y in self.outpost_locations], dtype=np.int64)
+        # The distance fields and route of the same world planned elsewhere, see get_route_state
+        if route_state is None:
+            self.compute_outpost_distances()
+        else:
+            self.outpost_distances, self.outpost_predecessors = route_state[:2]
+            self.distance_energy = self.environment.energy_requirement.flatten()
+        self._outpost_energy = self.get_outpost_energy_matrix()
+        self.energy_changed = False  # Set by update_energy, the distances are repaired when next read
+        self.nearest_outpost_fields = {}  # Visited bitmask -> field, see get_nearest_outpost_energy
         
-        self.G = nx.Graph()
-        self.shortest_path, self.min_path_length = self.get_target_trade_route()
-        self.target_route_energy = self.get_route_energy(self.shortest_path)
+        if route_state is None:
+            self.plan_route()
+        else:
+            self._shortest_path, self._min_path_length = route_state[2:]
+            self._target_route_energy = self.get_route_energy(self._shortest_path)
+        # Tiles change energy when paths are built and water is filled, and back when the world is reset
+        environment.add_energy_listener(self.update_energy)
+
+    # The outpost energies and the route follow the tile energies, see refresh_outpost_distances
+    @property
+    def outpost_energy(self):
+        self.refresh_outpost_distances()
+        return self._outpost_energy
+
+    @property
+    def shortest_path(self):
+        self.refresh_outpost_distances()
+        return self._shortest_path
+
+    @property
+    def min_path_length(self):
+        self.refresh_outpost_distances()
+        return self._min_path_length
+
+    @property
+    def target_route_energy(self):
+        self.refresh_outpost_distances()
+        return self._target_route_energy
+
+    def get_route_state(self):
+        """What a Target_Manager of the same world needs to start without searching, as route_state."""
+        self.refresh_outpost_distances()
+        return self.outpost_distances, self.outpost_predecessors, self._shortest_path, self._min_path_length
+
+    def plan_route(self):
+        self._shortest_path, self._min_path_length = self.get_target_trade_route()
+        self._target_route_energy = self.get_route_energy(self._shortest_path)
 
     def get_energy_grid(self):
-        grid = np.zeros_like(self.terrain_index_grid)
-        for x in range(self.width):
-            for y in range(self.height):
-                grid[x, y] = self.environment.terrain_object_grid[x, y].energy_requirement
-        return grid
+        return self.environment.energy_requirement.astype(self.terrain_index_grid.dtype)
     
+    def compute_outpost_distances(self):
+        """
+        Distance fields and shortest path trees of every outpost, from one batched Dijkstra over the grid in
+        which moving into a cell costs its energy. Rows of outpost_distances hold the energy of reaching every
+        cell (x * height + y) from an outpost, leaving out the energy of the outpost itself.
+        """
+        energy = self.environment.energy_requirement.ravel().astype(np.float64)
+        indptr, targets = get_grid_moves(self.width, self.height)
+        # Moves into zero energy cells (outposts) are kept as explicit zero weight edges
+        graph = csr_matrix((energy[targets], targets, indptr), shape=(energy.size, energy.size))
+        self.outpost_distances, self.outpost_predecessors = dijkstra(graph, indices=self.outpost_cells, return_predecessors=True)
+        self.distance_energy = self.environment.energy_requirement.flatten()  # Tile energies the fields hold for
+
+    def get_outpost_energy_matrix(self):
+        """The least energy between every pair of outposts, as calculate_path_energy finds it."""
+        energy = self.environment.energy_requirement.reshape(-1)
+        return (energy[self.outpost_cells, None] + self.outpost_distances[:, self.outpost_cells]).astype(np.int64)
+
+    def get_outpost_energy_fields(self):
+        """
+        (outposts, width, height) array of the least energy of walking from every cell to every outpost: the energy
+        of the cells entered after it, the outpost included. A path costs the same energy both ways round once both
+        ends are counted, so this is the distance field of the outpost plus its own energy less that of the cell.
+        """
+        self.refresh_outpost_distances()
+        energy = self.environment.energy_requirement.reshape(-1)
+        fields = self.outpost_distances + (energy[self.outpost_cells, None] - energy[None, :])
+        return fields.astype(np.int32).reshape(len(self.outpost_cells), self.width, self.height)
+
+    def get_nearest_outpost_energy(self, visited_mask):
+        """
+        (width, height) array of the least energy from every cell to the nearest outpost whose bit (in the order of
+        outpost_locations) is not set in visited_mask, built once per mask so that reward shaping is a lookup.
+        """
+        self.refresh_outpost_distances()
+        if visited_mask not in self.nearest_outpost_fields:
+            unvisited = [index for index in range(len(self.outpost_cells)) if not visited_mask >> index & 1]
+            self.nearest_outpost_fields[visited_mask] = self.get_outpost_energy_fields()[unvisited].min(axis=0)
+        return self.nearest_outpost_fields[visited_mask]
+
+    def update_energy(self, changes):
+        """
+        Environment listener for tile energy changes (x, y, old_energy, new_energy). energy_req_grid is patched
+        right away, the outpost distances only when next read, so changes undone by a reset cost nothing.
+        """
+        for x, y, old_energy, new_energy in changes:
+            self.energy_req_grid[x, y] = new_energy
+        self.energy_changed = True
+
+    def refresh_outpost_distances(self):
+        """
+        Repair the outpost distance fields around the tiles whose energy differs from distance_energy only, and
+        plan the route again if the energy between any two outposts changed.
+        """
+        if not self.energy_changed:
+            return
+        self.energy_changed = False
+        energy = self.environment.energy_requirement.reshape(-1)
+        changed = np.flatnonzero(energy != self.distance_energy)
+        if changed.size == 0:
+            return
+        self.nearest_outpost_fields.clear()
+        went_up = energy[changed] > self.distance_energy[changed]
+        increased, decreased = changed[went_up].tolist(), changed[~went_up].tolist()
+        for source in range(len(self.outpost_cells)):
+            self.repair_outpost_distances(source, increased, decreased)
+        self.distance_energy[changed] = energy[changed]
+
+        outpost_energy = self.get_outpost_energy_matrix()
+        if not np.array_equal(outpost_energy, self._outpost_energy):
+            self._outpost_energy = outpost_energy
+            self.plan_route()
+
+    def repair_outpost_distances(self, source, increased, decreased):
+        """
+        Bring the distance field and shortest path tree of one outpost up to date after the cells in increased
+        got more expensive and those in decreased cheaper. The subtrees below the increased cells are cleared and
+        filled in again from their border, and the decreased cells are relaxed, by one Dijkstra from those cells
+        that stops wherever distances stop improving, so the rest of the field is never visited.
+        """
+        # Memoryviews read and write the arrays as Python numbers, much faster than NumPy scalars one cell at a time
+        distances = memoryview(self.outpost_distances[source])
+        predecessors = memoryview(self.outpost_predecessors[source])
+        energy = memoryview(self.environment.energy_requirement.reshape(-1))
+        source_cell = int(self.outpost_cells[source])
+        neighbours = get_grid_neighbours(self.width, self.height)
+        infinity = float('inf')
+
+        # Cells whose shortest path went through a cell that got more expensive
+        cleared = set()
+        stack = [cell for cell in increased if cell != source_cell]
+        while stack:
+            cell = stack.pop()
+            if cell not in cleared:
+                cleared.add(cell)
+                stack.extend(neighbour for neighbour in neighbours[cell] if predecessors[neighbour] == cell)
+        for cell in cleared:
+            distances[cell] = infinity
+
+        heap = []
+        for cell in chain(cleared, decreased):
+            if cell == source_cell:
+                continue  # The field leaves out the energy of the outpost itself
+            for neighbour in neighbours[cell]:
+                new_energy = distances[neighbour] + energy[cell]
+                if new_energy < distances[cell]:
+                    distances[cell] = new_energy
+                    predecessors[cell] = neighbour
+            if distances[cell] < infinity:
+                heapq.heappush(heap, (distances[cell], cell))
+        while heap:
+            current_energy, cell = heapq.heappop(heap)
+            if current_energy > distances[cell]:
+                continue  # Stale entry of a cell reached again at a lower energy
+            for neighbour in neighbours[cell]:
+                new_energy = current_energy + energy[neighbour]
+                if neighbour != source_cell and new_energy < distances[neighbour]:
+                    distances[neighbour] = new_energy
+                    predecessors[neighbour] = cell
+                    heapq.heappush(heap, (new_energy, neighbour))
+
     def get_energy_required(self, path):
         """Calculate the energy required for a given path."""
-        energy = 0
-        for coords in path:
-            energy += self.environment.terrain_object_grid[coords].energy_requirement
-        return energy 
+        return int(sum(self.environment.energy_requirement[coords] for coords in path))
     
     def find_shortest_tsp_path(self):
-        nodes = list(self.G.nodes())
-        shortest_path = None
-        min_path_length = float('inf')
+        """Shortest closed tour over the outposts by energy, exact with Held-Karp up to held_karp_max_outposts outposts."""
+        solver = self.tsp_solver
+        if solver is None:
+            solver = held_karp_tour if len(self.outpost_locations) <= self.held_karp_max_outposts else local_search_tour
+        return solver(self.outpost_energy)
 
-        for permutation in permutations(nodes):
-            cycle = permutation + (permutation[0],)
-            path_length = sum(self.G.edges[cycle[n], cycle[n+1]]['weight'] for n in range(len(cycle) - 1))
-
-            if path_length < min_path_length:
-                shortest_path = cycle
-                min_path_length = path_length
-
-        return shortest_path, min_path_length
     def get_target_trade_route(self):
-        self.create_grid_graph(self.outpost_locations)
         shortest_path_indices, min_path_length = self.find_shortest_tsp_path()
         shortest_path_coords = [self.outpost_locations[index] for index in shortest_path_indices]
         return shortest_path_coords, min_path_length
@@ -57,24 +341,6 @@ class Target_Manager:
         """Calculate Manhattan distance between two points."""
         return abs(coord1[0] - coord2[0]) + abs(coord1[1] - coord2[1])
 
-    def create_grid_graph(self, outpost_coords):
-        """Create a fully connected graph from outpost coordinates."""
-        # Convert outpost coordinates to indices in a sorted list to handle arbitrary coordinates
-        coord_to_index = {coord: index for index, coord in enumerate(sorted(outpost_coords))}
-
-        # Add nodes
-        for coord, index in coord_to_index.items():
-            self.G.add_node(index, pos=coord)
-
-        # Add edges - each node is connected to every other node
-        for coord1 in outpost_coords:
-            for coord2 in outpost_coords:
-                if coord1 != coord2:
-                    from_id = coord_to_index[coord1]
-                    to_id = coord_to_index[coord2]
-                    weight = self.calculate_distance(coord1, coord2)
-                    self.G.add_edge(from_id, to_id, weight=weight)
-
     def get_energy_required(self, path):
         """Calculate the total energy required for the paths between outposts in the path."""
         total_energy = 0
@@ -86,60 +352,82 @@ class Target_Manager:
 
     def get_cell_energy(self, x, y):
         """Retrieve the energy requirement of the cell at (x, y)."""
-        return self.environment.terrain_object_grid[x, y].energy_requirement
+        return int(self.environment.energy_requirement[x, y])
 
     def get_energy_neighbous(self, x, y):
         """Retrieve the energy requirements of the neighbors of the cell at (x, y)."""
         neighbors = self.environment.get_neighbors(x, y)
         return [self.get_cell_energy(x, y) for x, y in neighbors]
 
-    def calculate_least_energy_path(self, start, end):
+    def least_energy_search(self, start, end, heuristic=None):
+        """
+        Dijkstra from start, the cost of a path being the energy of all its cells (start included), stopped
+        once end is reached. Costs and predecessors are flat arrays indexed x * height + y. With heuristic the
+        search is A*, guided by the smallest nonzero cell energy times the Manhattan distance to end less the
+        number of zero energy cells (outposts), which never overestimates so the energy found is the same.
+        Returns the cost and predecessor arrays.
+        """
+        if heuristic is None:
+            heuristic = self.use_heuristic
+        width, height = self.width, self.height
+        energy = self.environment.energy_requirement.ravel().tolist()
+        cost = np.full(width * height, np.iinfo(np.int64).max, dtype=np.int64)
+        prev = np.full(width * height, -1, dtype=np.int64)
+        source, target = start[0] * height + start[1], end[0] * height + end[1]
+        end_x, end_y = end
+        nonzero_energy = [value for value in energy if value > 0] if heuristic else []
+        scale = min(nonzero_energy, default=0)
+        free_cells = len(energy) - len(nonzero_energy)
+
+        def estimate(x, y):
+            return scale * max(0, abs(x - end_x) + abs(y - end_y) - free_cells)
+
+        cost[source] = energy[source]
+        heap = [(energy[source] + estimate(*start), energy[source], source)]  # (priority, energy, cell)
+        while heap:
+            _, current_energy, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if current_energy > cost[node]:
+                continue  # Stale entry of a cell reached again at a lower energy
+            x, y = divmod(node, height)
+            for neighbor, inside, nx, ny in ((node - height, x > 0, x - 1, y), (node + height, x < width - 1, x + 1, y),
+                                             (node - 1, y > 0, x, y - 1), (node + 1, y < height - 1, x, y + 1)):
+                if inside:
+                    new_energy = current_energy + energy[neighbor]
+                    if new_energy < cost[neighbor]:
+                        cost[neighbor] = new_energy
+                        prev[neighbor] = node
+                        heapq.heappush(heap, (new_energy + estimate(nx, ny), new_energy, neighbor))
+        return cost, prev
+
+    def calculate_least_energy_path(self, start, end, heuristic=None):
         """
         Calculate the path with the least energy required from start to end.
-        Uses a variation of Dijkstra's algorithm adapted for energy costs.
-        """
-        # Initialize distance map with infinity
-        energy_cost = {coord: float('inf') for coord in np.ndindex(self.energy_req_grid.shape)}
-        energy_cost[start] = self.get_cell_energy(*start)  # Start cell energy
-        prev = {coord: None for coord in np.ndindex(self.energy_req_grid.shape)}
-
-        pq = PriorityQueue()
-        pq.put((self.get_cell_energy(*start), start))  # Priority queue of (energy, coord)
-
-        while not pq.empty():
-            current_energy, current_coord = pq.get()
-            if current_coord == end:
-                break  # End reached, construct path
-
-            for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:  # Manhattan neighbors
-                neighbor = (current_coord[0] + dx, current_coord[1] + dy)
-                if 0 <= neighbor[0] < self.width and 0 <= neighbor[1] < self.height:  # Check bounds
-                    # Calculate new cost to neighbor
-                    new_energy = current_energy + self.get_cell_energy(*neighbor)
-                    if new_energy < energy_cost[neighbor]:
-                        energy_cost[neighbor] = new_energy
-                        prev[neighbor] = current_coord
-                        pq.put((new_energy, neighbor))
-
-        # Reconstruct the path from end to start
+        Uses a variation of Dijkstra's algorithm adapted for energy costs, see least_energy_search.
+        """
+        _, prev = self.least_energy_search(start, end, heuristic)
         path = []
-        current = end
-        while current is not None:
-            path.append(current)
-            current = prev[current]
+        node = end[0] * self.height + end[1]
+        while node != -1:
+            path.append(divmod(int(node), self.height))
+            node = prev[node]
         path.reverse()  # Reverse it to start -> end
         return path
 
-    def calculate_path_energy(self, start, end):
+    def calculate_path_energy(self, start, end, heuristic=None):
         """Calculate the least energy required to move from start to end."""
-        path = self.calculate_least_energy_path(start, end)
-        return sum(self.get_cell_energy(*coord) for coord in path)
+        cost, _ = self.least_energy_search(start, end, heuristic)
+        return int(cost[end[0] * self.height + end[1]])
     
     def get_route_energy(self, route):
-        """Calculate the total energy required for the path."""
+        """Calculate the total energy required for the path, legs between outposts read from outpost_energy."""
         total_energy = 0
         for i in range(len(route) - 1):
             start = route[i]
             end = route[i + 1]
-            total_energy += self.calculate_path_energy(start, end)
+            if start in self.outpost_index and end in self.outpost_index:
+                total_energy += int(self.outpost_energy[self.outpost_index[start], self.outpost_index[end]])
+            else:
+                total_energy += self.calculate_path_energy(start, end)
         return total_energy
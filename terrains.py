@@ -3,7 +3,17 @@ import pygame
 
 from entities import Tree, MossyRock, SnowyRock, Fish, WoodPath
 class Terrain:
-    def __init__(self, x, y, tile_size, entity_prob):
+    """
+    Facade over one tile of the world. Passability, energy requirement and elevation live in the arrays of
+    the world (the Environment), the object keeps the image and entity bookkeeping used for rendering.
+    """
+    __slots__ = ('world', 'grid_x', 'grid_y', 'tile_size', 'screen_x', 'screen_y', 'colour', 'image',
+                 'entity_type', 'entity_index', 'entity_prob', 'entity_on_tile')
+    _images = {}
+    resource_type = None  # Entity class a tile of this terrain can be generated with
+
+    def __init__(self, x, y, tile_size, entity_prob, world):
+        self.world = world
         self.grid_x = x
         self.grid_y = y
         self.tile_size = tile_size
@@ -11,18 +21,76 @@ class Terrain:
         self.screen_y = y * tile_size
         self.colour = None
         self.image = None
-        self.elevation = None
-        self.energy_requirement = None
         self.passable = True
         self.entity_type = None
         self.entity_index = None
         self.entity_prob = entity_prob
         self.entity_on_tile = None
 
+    @classmethod
+    def from_world(cls, x, y, tile_size, entity_prob, world, elevation):
+        """
+        Facade over a tile whose state is already in the world arrays, as Environment.load_world_state builds
+        them: only the bookkeeping is set, nothing is written to the arrays.
+        """
+        terrain = cls.__new__(cls)
+        terrain.world = world
+        terrain.grid_x = x
+        terrain.grid_y = y
+        terrain.tile_size = tile_size
+        terrain.screen_x = x * tile_size
+        terrain.screen_y = y * tile_size
+        terrain.colour = cls.set_colour(elevation)
+        terrain.image = terrain.create_image()
+        terrain.entity_type = cls.resource_type
+        terrain.entity_index = None
+        terrain.entity_prob = entity_prob
+        terrain.entity_on_tile = None
+        return terrain
+
+    @property
+    def passable(self):
+        return bool(self.world.passable[self.grid_x, self.grid_y])
+
+    @passable.setter
+    def passable(self, value):
+        self.world.passable[self.grid_x, self.grid_y] = value
+
+    @property
+    def energy_requirement(self):
+        return int(self.world.energy_requirement[self.grid_x, self.grid_y])
+
+    @energy_requirement.setter
+    def energy_requirement(self, value):
+        self.world.set_energy_requirement(self.grid_x, self.grid_y, value)
+
+    @property
+    def elevation(self):
+        return int(self.world.elevation[self.grid_x, self.grid_y])
+
+    @elevation.setter
+    def elevation(self, value):
+        self.world.elevation[self.grid_x, self.grid_y] = value
+
+    def save_state(self):
+        return self.__class__, tuple(getattr(self, name) for name in Terrain.__slots__)
+
+    def load_state(self, state):
+        terrain_class, values = state
+        self.__class__ = terrain_class
+        for name, value in zip(Terrain.__slots__, values):
+            setattr(self, name, value)
+
     def create_image(self):
-        image = pygame.Surface((self.tile_size, self.tile_size))
-        image.fill(self.colour)
-        return image
+        if self.world.headless:
+            return None
+        # Tiles of the same colour share one surface, it is only ever blitted
+        key = (self.colour, self.tile_size)
+        if key not in self._images:
+            image = pygame.Surface((self.tile_size, self.tile_size))
+            image.fill(self.colour)
+            self._images[key] = image
+        return self._images[key]
     
     def add_entity(self, entity):
         self.entity_on_tile = entity
@@ -50,7 +118,8 @@ class Terrain:
         self.entity_on_tile = None
         self.passable = True
 
-    def set_colour(self, id):
+    @staticmethod
+    def set_colour(id):
         if id == 0:
             return (0, 0, 128)
         elif id == 1:
@@ -67,14 +136,17 @@ class Terrain:
             return (0, 0, 0)
 
 class DeepWater(Terrain):
-    def __init__(self, x, y, tile_size, entity_prob):
-        super().__init__(x, y, tile_size, entity_prob)
+    __slots__ = ()
+    resource_type = Fish
+
+    def __init__(self, x, y, tile_size, entity_prob, world):
+        super().__init__(x, y, tile_size, entity_prob, world)
         
         self.elevation = 0
         self.colour = self.set_colour(self.elevation)
         self.image = self.create_image()
         self.energy_requirement = 10
-        self.entity_type = Fish
+        self.entity_type = self.resource_type
         self.entity_prob = entity_prob
 
     def shallow(self):
@@ -86,14 +158,17 @@ class DeepWater(Terrain):
         self.entity_type = Fish
 
 class Water(Terrain):
-    def __init__(self, x, y, tile_size, entity_prob):
-        super().__init__(x, y, tile_size, entity_prob)
+    __slots__ = ()
+    resource_type = Fish
+
+    def __init__(self, x, y, tile_size, entity_prob, world):
+        super().__init__(x, y, tile_size, entity_prob, world)
         
         self.elevation = 1
         self.colour = self.set_colour(self.elevation)
         self.image = self.create_image()
         self.energy_requirement = 6
-        self.entity_type = Fish
+        self.entity_type = self.resource_type
         self.entity_prob = entity_prob
 
     def land_fill(self):
@@ -105,45 +180,57 @@ class Water(Terrain):
         self.entity_type = Tree
 
 class Plains(Terrain):
-    def __init__(self, x, y, tile_size, entity_prob):
-        super().__init__(x, y, tile_size, entity_prob)
+    __slots__ = ()
+    resource_type = Tree
+
+    def __init__(self, x, y, tile_size, entity_prob, world):
+        super().__init__(x, y, tile_size, entity_prob, world)
         
         self.elevation = 2
         self.colour = self.set_colour(self.elevation)
         self.image = self.create_image()
         self.energy_requirement = 2
-        self.entity_type = Tree
+        self.entity_type = self.resource_type
         self.entity_prob = entity_prob
 
 class Hills(Terrain):
-    def __init__(self, x, y, tile_size, entity_prob):
-        super().__init__(x, y, tile_size, entity_prob)
+    __slots__ = ()
+    resource_type = Tree
+
+    def __init__(self, x, y, tile_size, entity_prob, world):
+        super().__init__(x, y, tile_size, entity_prob, world)
         
         self.elevation = 3
         self.colour = self.set_colour(self.elevation)
         self.image = self.create_image()
         self.energy_requirement = 3
-        self.entity_type = Tree
+        self.entity_type = self.resource_type
         self.entity_prob = entity_prob
 
 class Mountains(Terrain):
-    def __init__(self, x, y, tile_size, entity_prob):
-        super().__init__(x, y, tile_size, entity_prob)
+    __slots__ = ()
+    resource_type = MossyRock
+
+    def __init__(self, x, y, tile_size, entity_prob, world):
+        super().__init__(x, y, tile_size, entity_prob, world)
         
         self.elevation = 4
         self.colour = self.set_colour(self.elevation)
         self.image = self.create_image()
         self.energy_requirement = 5
-        self.entity_type = MossyRock
+        self.entity_type = self.resource_type
         self.entity_prob = entity_prob
 
 class Snow(Terrain):
-    def __init__(self, x, y, tile_size, entity_prob):
-        super().__init__(x, y, tile_size, entity_prob)
+    __slots__ = ()
+    resource_type = SnowyRock
+
+    def __init__(self, x, y, tile_size, entity_prob, world):
+        super().__init__(x, y, tile_size, entity_prob, world)
         
         self.elevation = 5
         self.colour = self.set_colour(self.elevation)
         self.image = self.create_image()
         self.energy_requirement = 4
-        self.entity_type = SnowyRock
+        self.entity_type = self.resource_type
         self.entity_prob = entity_prob
@@ -17,7 +17,8 @@ from stable_baselines3 import PPO
 from stable_baselines3.common.monitor import Monitor
 from stable_baselines3.common.callbacks import EvalCallback, BaseCallback
 from custom_env import CustomEnv
-from agent_model import AgentModel
+from simulation_manager import SimulationManager
+from agent_model import AgentModel, CompactMultiInputPolicy, CompactDictRolloutBuffer
 from logger import Logger
 
 torch.cuda.empty_cache()
@@ -28,10 +29,26 @@ class EnvironmentManager:
         self.simulation_manager_args = simulation_manager_args
         self.model_args = model_args
 
-    def make_env(self):
-        env = CustomEnv(self.game_manager_args, self.simulation_manager_args, self.model_args, plot = False)
+    def make_env(self, simulation_manager=None):
+        # SB3's VecEnvs copy observations into their own buffers, so the env does not need to
+        env = CustomEnv(self.game_manager_args, self.simulation_manager_args, self.model_args, plot = False,
+                        simulation_manager=simulation_manager, copy_observations=False)
         return Monitor(env)
 
+    def make_world_pool(self, pool_index=0):
+        """
+        Generate a pool of worlds that environments of several experiments can share. With a seed, pools of
+        different indices are generated from different master seeds.
+        """
+        seed = self.simulation_manager_args.get('seed')
+        return SimulationManager(
+            self.game_manager_args,
+            self.simulation_manager_args['number_of_environments'],
+            self.simulation_manager_args['number_of_curricula'],
+            self.simulation_manager_args['min_episodes_per_curriculum'],
+            num_workers=self.simulation_manager_args.get('num_workers', 1),
+            seed=None if seed is None else seed + pool_index)
+
     def set_kg_completeness(self, env, completeness):
         # Access the unwrapped environment to set KG completeness
         env.unwrapped.set_kg_completeness(completeness)
@@ -212,11 +229,14 @@ class ModelTrainer:
 
     def create_model(self, model_config):
         self.logger.info("Creating PPO model", logger_name='training')
-        self.rl_model = PPO("MultiInputPolicy", 
+        # Compact observations stay in their storage dtypes in the rollout buffer until AgentModel
+        compact = 'node_mask' in self.env.observation_space.spaces
+        self.rl_model = PPO(CompactMultiInputPolicy if compact else "MultiInputPolicy", 
                     self.env, 
+                    rollout_buffer_class=CompactDictRolloutBuffer if compact else None,
                     policy_kwargs={
                         'features_extractor_class': AgentModel,
-                        'features_extractor_kwargs': {'features_dim': 64}
+                        'features_extractor_kwargs': {'features_dim': 64, 'vision_mode': self.env.unwrapped.vision_mode}
                     },
                     **model_config,
                     device=self.device,
@@ -303,6 +323,7 @@ class AblationStudy:
         self.logger = logger
         self.results = {}
         self.results_dir = self._create_results_directory()
+        self.world_pools = None  # (train, eval) worlds shared by every experiment
 
     def _create_results_directory(self):
         # Create a 'results' folder if it doesn't exist
@@ -325,7 +346,7 @@ class AblationStudy:
             
             try:
                 trainer = Trainer(kg_completeness, ablation_study=self)
-                trainer.setup(self.base_config)
+                trainer.setup(self.base_config, self.get_world_pools())
                 trainer.env_manager.set_kg_completeness(trainer.env, kg_completeness)
                 trainer.env_manager.set_kg_completeness(trainer.eval_env, kg_completeness)
                 
@@ -341,6 +362,15 @@ class AblationStudy:
         self._save_results()
         self.logger.info("Ablation Study completed")
 
+    def get_world_pools(self):
+        # Completeness only masks the knowledge graph of a world, so one pool serves every experiment
+        if self.world_pools is None:
+            env_manager = EnvironmentManager(self.base_config['game_manager_args'],
+                                             self.base_config['simulation_manager_args'],
+                                             self.base_config['model_args'])
+            self.world_pools = (env_manager.make_world_pool(), env_manager.make_world_pool(pool_index=1))
+        return self.world_pools
+
     def _save_results(self):
         results_file = os.path.join(self.results_dir, 'ablation_study_results.json')
         with open(results_file, 'w') as f:
@@ -368,20 +398,20 @@ class Trainer:
         self.current_kg_completeness = current_kg_completeness
         self.ablation_study = ablation_study
 
-    def setup(self, config):
+    def setup(self, config, world_pools=(None, None)):
         self.config = config
         self.env_manager: EnvironmentManager = EnvironmentManager(config['game_manager_args'], 
                                               config['simulation_manager_args'], 
                                               config['model_args'])
         
         self.logger.info("Creating environment", logger_name='training')
-        self.env: CustomEnv = self.env_manager.make_env()
+        self.env: CustomEnv = self.env_manager.make_env(world_pools[0])
         self.env.unwrapped.simulation_manager.min_episodes_per_curriculum = config['curriculum_config']['min_episodes_per_curriculum']
         self.env.unwrapped.simulation_manager.performance_threshold = config['curriculum_config']['performance_threshold']
         self.logger.info("Environment created successfully", logger_name='training')
 
         self.logger.info("Creating evaluation environment", logger_name='eval')
-        self.eval_env: CustomEnv = self.env_manager.make_env()
+        self.eval_env: CustomEnv = self.env_manager.make_env(world_pools[1])
         self.eval_env.unwrapped.simulation_manager.min_episodes_per_curriculum = config['curriculum_config']['min_episodes_per_curriculum']
         self.eval_env.unwrapped.simulation_manager.performance_threshold = config['curriculum_config']['performance_threshold']
         self.logger.info("Evaluation environment created successfully", logger_name='eval')
@@ -446,7 +476,7 @@ if __name__ == '__main__':
             'number_of_environments': 3000,
             'number_of_curricula': 30,
             'min_episodes_per_curriculum': min_episodes_per_curriculum},
-        'game_manager_args': {'num_tiles': 5, 'screen_size': 20, 'vision_range': 1},
+        'game_manager_args': {'num_tiles': 5, 'screen_size': 20, 'vision_range': 1, 'compact': True, 'headless': True},
         'model_config': {
             'n_steps': 2048 * 2,
             'batch_size': 512,